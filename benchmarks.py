@@ -87,6 +87,14 @@ async def async_parallel_insert_benchmark():
         assert v == f"val{i}"
     t1 = time.time()
     print(f"[ASYNC PARALLEL] Get {N}: {t1-t0:.3f}s")
+    t0 = time.time()
+    keys = [f"key{i:06}" for i in range(N)]
+    results = []
+    for i in range(0, N, 1000):
+        results.extend(await table.multi_get(keys[i:i + 1000]))
+    for i, v in enumerate(results):
+        assert v == f"val{i}"
+    print(f"[ASYNC PARALLEL] multi_get {N} in batches of 1000: {time.time() - t0:.3f}s")
     range_queries = generage_queries()
     t0 = time.time()
     results = await asyncio.gather(*[table.range(start, end) for start, end in range_queries])
@@ -94,6 +102,21 @@ async def async_parallel_insert_benchmark():
         assert len(res) <= range_size
     print(f"[ASYNC PARALLEL] range x{num_ranges} of size {range_size}: {time.time() - t0:.3f}s")
     shutil.rmtree(TEST_DIR)
+
+def compaction_benchmark(compaction):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=1000, compaction=compaction)
+    keys = [f"key{random.randint(0, N - 1):06}" for _ in range(N)]
+    loop = asyncio.new_event_loop()
+    t0 = time.time()
+    for i, k in enumerate(keys):
+        loop.run_until_complete(table.insert(k, f"val{i}"))
+    t1 = time.time()
+    files = sum(len(comps) for comps in table.levels)
+    print(f"[{compaction.upper()}] Insert {N} random keys: {t1-t0:.3f}s, {files} files")
+    loop.close()
+    shutil.rmtree(TEST_DIR)
         
 if __name__ == "__main__":
     print("--- SYNC BENCHMARK ---")
@@ -102,4 +125,7 @@ if __name__ == "__main__":
     asyncio.run(async_benchmark())
     print("--- ASYNC PARALLEL INSERT BENCHMARK ---")
     asyncio.run(async_parallel_insert_benchmark())
+    print("--- COMPACTION BENCHMARK ---")
+    compaction_benchmark('tiered')
+    compaction_benchmark('leveled')
 # Бенчмарки для LSM-дерева
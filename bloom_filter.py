@@ -2,6 +2,9 @@ import math
 import hashlib
 import struct
 import threading
+import numpy as np
+
+MASK64 = (1 << 64) - 1
 
 class BloomFilter:
     def __init__(self, size: int, num_hashes: int, seeds=None, bitarray=None):
@@ -17,8 +20,8 @@ class BloomFilter:
         else:
             self.bitarray = bitarray
 
-    def _hashes(self, key: str):
-        key_bytes = key.encode('utf-8')
+    def _hashes(self, key):
+        key_bytes = key if isinstance(key, bytes) else key.encode('utf-8')
         for seed in self.seeds:
             h = hashlib.blake2b(key_bytes, digest_size=8, key=seed.to_bytes(8, 'little'))
             yield int.from_bytes(h.digest(), 'little') % self.size
@@ -34,6 +37,9 @@ class BloomFilter:
                 return False
         return True
 
+    def contains_many(self, keys):
+        return [key in self for key in keys]
+
     def serialize(self) -> bytes:
         data = struct.pack('II', self.size, self.num_hashes)
         for seed in self.seeds:
@@ -59,3 +65,262 @@ class BloomFilter:
         with self.lock:
             for i in range(len(self.bitarray)):
                 self.bitarray[i] |= other.bitarray[i]
+
+
+class DoubleHashBloomFilter:
+    MAGIC = b'KMB1'
+
+    def __init__(self, size: int, num_hashes: int, bits=None):
+        self.size = max(size, 64)
+        self.num_hashes = num_hashes
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8) if bits is None else bits
+        self._steps = np.arange(num_hashes, dtype=np.uint64)
+        self._view = memoryview(self.bits)
+
+    @classmethod
+    def build(cls, keys, p):
+        size, num_hashes = BloomFilter.optimal_size(max(len(keys), 1), p)
+        bloom = cls(size, num_hashes)
+        bloom.add_many(keys)
+        bloom.fpr = p
+        return bloom
+
+    @staticmethod
+    def _digest(key):
+        key_bytes = key if isinstance(key, bytes) else key.encode('utf-8')
+        return hashlib.blake2b(key_bytes, digest_size=16).digest()
+
+    def _positions(self, keys):
+        digests = b''.join(self._digest(k) for k in keys)
+        h = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        return (h[:, :1] + self._steps * h[:, 1:]) % np.uint64(self.size)
+
+    def add(self, key):
+        self.add_many([key])
+
+    def add_many(self, keys):
+        if not keys:
+            return
+        pos = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3), np.left_shift(1, pos & np.uint64(7)).astype(np.uint8))
+
+    def _key_positions(self, key):
+        digest = self._digest(key)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little')
+        for i in range(self.num_hashes):
+            yield ((h1 + i * h2) & MASK64) % self.size
+
+    def __contains__(self, key):
+        bits = self._view
+        for pos in self._key_positions(key):
+            if not (bits[pos >> 3] >> (pos & 7)) & 1:
+                return False
+        return True
+
+    def contains_many(self, keys):
+        if not keys:
+            return []
+        pos = self._positions(keys)
+        hits = (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+        return hits.all(axis=1).tolist()
+
+    def serialize(self) -> bytes:
+        return self.MAGIC + struct.pack('QI', self.size, self.num_hashes) + self.bits.tobytes()
+
+    @classmethod
+    def deserialize(cls, data: bytes):
+        size, num_hashes = struct.unpack_from('QI', data, 4)
+        bits = np.frombuffer(data, dtype=np.uint8, offset=4 + struct.calcsize('QI')).copy()
+        return cls(size, num_hashes, bits)
+
+
+class BlockedBloomFilter(DoubleHashBloomFilter):
+    MAGIC = b'BBF1'
+    BLOCK_BITS = 512
+
+    def __init__(self, size: int, num_hashes: int, bits=None):
+        num_blocks = max(1, -(-size // self.BLOCK_BITS))
+        super().__init__(num_blocks * self.BLOCK_BITS, num_hashes, bits)
+        self.num_blocks = num_blocks
+
+    def _positions(self, keys):
+        digests = b''.join(self._digest(k) for k in keys)
+        h = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        base = (h[:, :1] % np.uint64(self.num_blocks)) * np.uint64(self.BLOCK_BITS)
+        lo = h[:, 1:] & np.uint64(0xffffffff)
+        step = (h[:, 1:] >> np.uint64(32)) | np.uint64(1)
+        return base + ((lo + self._steps * step) & np.uint64(self.BLOCK_BITS - 1))
+
+    def _key_positions(self, key):
+        digest = self._digest(key)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little')
+        base = (h1 % self.num_blocks) * self.BLOCK_BITS
+        lo = h2 & 0xffffffff
+        step = (h2 >> 32) | 1
+        for i in range(self.num_hashes):
+            yield base + ((lo + i * step) & (self.BLOCK_BITS - 1))
+
+
+def _mix(h):
+    h = (h ^ (h >> 33)) * 0xff51afd7ed558ccd & MASK64
+    h = (h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53 & MASK64
+    return h ^ (h >> 33)
+
+
+def _mix_array(h):
+    h = (h ^ (h >> np.uint64(33))) * np.uint64(0xff51afd7ed558ccd)
+    h = (h ^ (h >> np.uint64(33))) * np.uint64(0xc4ceb9fe1a85ec53)
+    return h ^ (h >> np.uint64(33))
+
+
+class XorFilter:
+    MAGIC = b'XOR8'
+    fpr = 1 / 256
+
+    def __init__(self, seed: int, block_length: int, fingerprints=None):
+        self.seed = seed
+        self.block_length = block_length
+        if fingerprints is None:
+            fingerprints = np.zeros(3 * block_length, dtype=np.uint8)
+        self.fingerprints = fingerprints
+        self._view = memoryview(fingerprints)
+
+    @staticmethod
+    def _hash(key):
+        key_bytes = key if isinstance(key, bytes) else key.encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little')
+
+    def _slots(self, h):
+        bl = self.block_length
+        r1 = ((h << 21) | (h >> 43)) & MASK64
+        r2 = ((h << 42) | (h >> 22)) & MASK64
+        return ((h & 0xffffffff) * bl >> 32,
+                ((r1 & 0xffffffff) * bl >> 32) + bl,
+                ((r2 & 0xffffffff) * bl >> 32) + 2 * bl)
+
+    @staticmethod
+    def _fingerprint(h):
+        return (h ^ (h >> 32)) & 0xff
+
+    @classmethod
+    def build(cls, keys, p=None):
+        hashes = list({cls._hash(k) for k in keys})
+        block_length = (int(1.23 * len(hashes)) + 32) // 3 + 1
+        for seed in range(1, 64):
+            xf = cls(seed, block_length)
+            mixed = [_mix(h ^ seed) for h in hashes]
+            order = xf._peel(mixed)
+            if order is not None:
+                fp = xf.fingerprints
+                for h, slot in reversed(order):
+                    a, b, c = xf._slots(h)
+                    fp[slot] = xf._fingerprint(h) ^ fp[a] ^ fp[b] ^ fp[c]
+                return xf
+        raise ValueError("Unable to construct xor filter")
+
+    def _peel(self, mixed):
+        size = 3 * self.block_length
+        count = [0] * size
+        xor = [0] * size
+        for h in mixed:
+            for slot in self._slots(h):
+                count[slot] += 1
+                xor[slot] ^= h
+        stack = [slot for slot in range(size) if count[slot] == 1]
+        order = []
+        while stack:
+            slot = stack.pop()
+            if count[slot] != 1:
+                continue
+            h = xor[slot]
+            order.append((h, slot))
+            for other in self._slots(h):
+                count[other] -= 1
+                xor[other] ^= h
+                if count[other] == 1:
+                    stack.append(other)
+        return order if len(order) == len(mixed) else None
+
+    def __contains__(self, key):
+        h = _mix(self._hash(key) ^ self.seed)
+        a, b, c = self._slots(h)
+        fp = self._view
+        return self._fingerprint(h) == fp[a] ^ fp[b] ^ fp[c]
+
+    def contains_many(self, keys):
+        if not keys:
+            return []
+        h = np.array([self._hash(k) for k in keys], dtype=np.uint64)
+        h = _mix_array(h ^ np.uint64(self.seed))
+        bl = np.uint64(self.block_length)
+        low = np.uint64(0xffffffff)
+        r1 = (h << np.uint64(21)) | (h >> np.uint64(43))
+        r2 = (h << np.uint64(42)) | (h >> np.uint64(22))
+        fp = self.fingerprints
+        found = (fp[((h & low) * bl) >> np.uint64(32)] ^
+                 fp[(((r1 & low) * bl) >> np.uint64(32)) + bl] ^
+                 fp[(((r2 & low) * bl) >> np.uint64(32)) + np.uint64(2) * bl])
+        return (found == ((h ^ (h >> np.uint64(32))) & np.uint64(0xff)).astype(np.uint8)).tolist()
+
+    def serialize(self) -> bytes:
+        return self.MAGIC + struct.pack('QQ', self.seed, self.block_length) + self.fingerprints.tobytes()
+
+    @classmethod
+    def deserialize(cls, data: bytes):
+        seed, block_length = struct.unpack_from('QQ', data, 4)
+        fingerprints = np.frombuffer(data, dtype=np.uint8, offset=20).copy()
+        return cls(seed, block_length, fingerprints)
+
+
+class UniformFilterPolicy:
+    def __init__(self, fpr=0.01, skip_last_level=False):
+        self.fpr = fpr
+        self.skip_last_level = skip_last_level
+
+    def level_fprs(self, num_levels, size_ratio):
+        fprs = [self.fpr] * num_levels
+        if self.skip_last_level and num_levels > 1:
+            fprs[-1] = 1.0
+        return fprs
+
+
+class MonkeyFilterPolicy(UniformFilterPolicy):
+    def __init__(self, bits_per_key=10, skip_last_level=False):
+        super().__init__(math.exp(-bits_per_key * math.log(2) ** 2), skip_last_level)
+        self.bits_per_key = bits_per_key
+
+    def level_fprs(self, num_levels, size_ratio):
+        weights = [size_ratio ** i for i in range(num_levels)]
+        total = sum(weights)
+        fractions = [w / total for w in weights]
+        filtered = list(range(num_levels))
+        budget = self.bits_per_key * math.log(2) ** 2
+        fprs = [1.0] * num_levels
+        while filtered:
+            share = sum(fractions[i] for i in filtered)
+            log_r = (-budget - sum(fractions[i] * math.log(fractions[i]) for i in filtered)) / share
+            capped = [i for i in filtered if log_r + math.log(fractions[i]) >= 0]
+            if not capped:
+                for i in filtered:
+                    fprs[i] = math.exp(log_r) * fractions[i]
+                break
+            filtered = [i for i in filtered if i not in capped]
+        if self.skip_last_level and num_levels > 1:
+            fprs[-1] = 1.0
+        return fprs
+
+
+FILTERS = {
+    'bloom': DoubleHashBloomFilter,
+    'blocked': BlockedBloomFilter,
+    'xor': XorFilter,
+}
+
+
+def load_filter(data: bytes):
+    for cls in FILTERS.values():
+        if data[:4] == cls.MAGIC:
+            return cls.deserialize(data)
+    return BloomFilter.deserialize(data)
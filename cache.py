@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+
+
+class LruCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.usage = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, charge):
+        if charge > self.capacity:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.usage -= old[1]
+            self.entries[key] = (value, charge)
+            self.usage += charge
+            while self.usage > self.capacity:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.usage -= evicted
+
+    def erase(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.usage -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.usage = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'usage': self.usage}
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,13 +1,226 @@
 import os
+import json
+import mmap
 import struct
-from bloom_filter import BloomFilter
+import zlib
+import lzma
+import bz2
+from array import array
+from bisect import bisect_left, bisect_right
+from bloom_filter import FILTERS, load_filter
+from encoding import encode, decode, json_key, from_json_key, POINTER_FLAG, LENGTH_MASK
+
+MAGIC = b'LSM2'
+HEADER_SIZE = 4 + struct.calcsize('IIQ')
+BLOCK_MAGIC = b'LSM3'
+FOOTER = struct.Struct('QQQQQQ')
+CODECS = {
+    None: (0, None, None),
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'lzma': (2, lzma.compress, lzma.decompress),
+    'bz2': (3, bz2.compress, bz2.decompress),
+}
+DECOMPRESS = {codec_id: decompress for codec_id, _, decompress in CODECS.values()}
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _shared_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class Block:
+    def __init__(self, data, restart_interval):
+        self.data = data
+        num_restarts = struct.unpack_from('I', data, len(data) - 4)[0]
+        self.limit = len(data) - 4 - num_restarts * 4
+        self.restarts = array('I', data[self.limit:len(data) - 4])
+        self.interval = restart_interval
+
+    def _restart_key(self, r):
+        pos = self.restarts[r]
+        unshared = struct.unpack_from('II', self.data, pos)[1]
+        return decode(self.data[pos + 8:pos + 8 + (unshared & LENGTH_MASK)], unshared)
+
+    def _iter_restart(self, r, values=True):
+        data = self.data
+        pos = self.restarts[r]
+        prev = b''
+        while pos < self.limit:
+            shared, unshared = struct.unpack_from('II', data, pos)
+            pos += 8
+            prev = prev[:shared] + data[pos:pos + (unshared & LENGTH_MASK)]
+            pos += unshared & LENGTH_MASK
+            seq, value_len = struct.unpack_from('QI', data, pos)
+            pos += 12
+            if values:
+                yield decode(prev, unshared), seq, decode(data[pos:pos + (value_len & LENGTH_MASK)], value_len)
+            else:
+                yield decode(prev, unshared)
+            pos += value_len & LENGTH_MASK
+
+    def iter_from(self, i):
+        r = i // self.interval
+        if r >= len(self.restarts):
+            return
+        it = self._iter_restart(r)
+        for _ in range(i - r * self.interval):
+            if next(it, None) is None:
+                return
+        yield from it
+
+    def _bound(self, key, inclusive):
+        l, r = 0, len(self.restarts) - 1
+        start = 0
+        while l <= r:
+            m = (l + r) // 2
+            k = self._restart_key(m)
+            if k < key or (inclusive and k == key):
+                start = m
+                l = m + 1
+            else:
+                r = m - 1
+        idx = start * self.interval
+        for k in self._iter_restart(start, values=False):
+            if k > key or (not inclusive and k == key):
+                break
+            idx += 1
+        return idx
+
+    def lower_bound(self, key):
+        return self._bound(key, False)
+
+    def upper_bound(self, key):
+        return self._bound(key, True)
 
 class DiskComponent:
-    def __init__(self, path):
+    def __init__(self, path, key_range=None, use_mmap=False, cache=None, value_log=None):
         self.path = path
         self.file = open(path, 'rb')
+        self.refs = 0
+        self.obsolete = False
+        self.cache = cache
+        self.value_log = value_log
+        self.mm = None
+        if use_mmap:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
         self._read_header()
+        if self.mm is not None and not self.blocked:
+            end = self.offsets_start + self.num_keys * 8
+            self.offsets = memoryview(self.mm)[self.offsets_start:end].cast('Q')
         self._load_bloom()
+        if value_log is not None:
+            value_log.ref(self.blob_refs)
+        if key_range is None:
+            self._load_key_range()
+        else:
+            self.min_key, self.max_key = key_range
+
+    @classmethod
+    def write(cls, path, items, block_size=4096, compression=None, restart_interval=16, filter_type='bloom',
+              filter_fpr=0.01, range_deletes_applied=0, sync=True, **options):
+        codec_id, compress, _ = CODECS[compression]
+        index = []
+        bloom_keys = []
+        num_keys = 0
+        max_seq = 0
+        min_seq = None
+        last_key = None
+        block = bytearray()
+        restarts = array('I')
+        block_key = None
+        block_count = 0
+        prev = b''
+        blob_refs = {}
+        with open(path, 'wb') as f:
+            f.write(BLOCK_MAGIC)
+            for k, seq, v in items:
+                k_bytes, k_flag = encode(k)
+                v_bytes, v_flag = encode(v)
+                if block_key is None:
+                    block_key = k
+                if block_count % restart_interval == 0:
+                    restarts.append(len(block))
+                    shared = 0
+                else:
+                    shared = _shared_prefix(prev, k_bytes)
+                block += struct.pack('II', shared, (len(k_bytes) - shared) | k_flag) + k_bytes[shared:]
+                block += struct.pack('QI', seq, len(v_bytes) | v_flag) + v_bytes
+                prev = k_bytes
+                block_count += 1
+                if v_flag & POINTER_FLAG:
+                    blob_refs[v.file] = blob_refs.get(v.file, 0) + v.size
+                if k != last_key:
+                    bloom_keys.append(k)
+                    last_key = k
+                max_seq = max(max_seq, seq)
+                min_seq = seq if min_seq is None else min(min_seq, seq)
+                num_keys += 1
+                if len(block) >= block_size:
+                    block += restarts.tobytes() + struct.pack('I', len(restarts))
+                    index.append(cls._write_block(f, block, block_key, block_count, codec_id, compress))
+                    block = bytearray()
+                    restarts = array('I')
+                    block_key = None
+                    block_count = 0
+            if block:
+                block += restarts.tobytes() + struct.pack('I', len(restarts))
+                index.append(cls._write_block(f, block, block_key, block_count, codec_id, compress))
+            index_offset = f.tell()
+            for key, offset, size, count, crc, block_codec in index:
+                k_bytes, k_flag = encode(key)
+                f.write(struct.pack('I', len(k_bytes) | k_flag) + k_bytes +
+                        struct.pack('QIIIB', offset, size, count, crc, block_codec))
+            bloom_bytes = b''
+            if filter_fpr < 1:
+                bloom = FILTERS[filter_type].build(bloom_keys, filter_fpr)
+                bloom_bytes = bloom.serialize()
+                filter_fpr = bloom.fpr
+            bloom_offset = f.tell()
+            f.write(bloom_bytes)
+            props = json.dumps({
+                'entries': num_keys, 'max_seq': max_seq, 'block_size': block_size, 'compression': compression,
+                'restart_interval': restart_interval,
+                'min_key': json_key(index[0][0]) if index else None,
+                'max_key': json_key(last_key),
+                'filter_fpr': filter_fpr,
+                'min_seq': min_seq or 0,
+                'range_deletes_applied': range_deletes_applied,
+                'blob_refs': blob_refs,
+            }).encode('utf-8')
+            props_offset = f.tell()
+            f.write(props)
+            f.write(FOOTER.pack(index_offset, bloom_offset - index_offset, bloom_offset, len(bloom_bytes),
+                                props_offset, len(props)))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if sync:
+            fsync_dir(os.path.dirname(path) or '.')
+        return cls(path, **options)
+
+    @staticmethod
+    def _write_block(f, block, key, count, codec_id, compress):
+        data = bytes(block)
+        if compress is not None:
+            packed = compress(data)
+            if len(packed) < len(data):
+                data = packed
+            else:
+                codec_id = 0
+        offset = f.tell()
+        f.write(data)
+        return key, offset, len(data), count, zlib.crc32(data), codec_id
 
     @property
     def extract_num(self):
@@ -17,81 +230,332 @@ class DiskComponent:
 
     def _read_header(self):
         self.file.seek(0)
-        header = self.file.read(8)
-        self.num_keys, self.bloom_size = struct.unpack('II', header)
-        self.offsets_start = 8
+        header = self.file.read(HEADER_SIZE)
+        self.blocked = header[:4] == BLOCK_MAGIC
+        if self.blocked:
+            self._read_footer()
+        elif header[:4] == MAGIC:
+            self.num_keys, self.bloom_size, self.max_seq = struct.unpack('IIQ', header[4:])
+            self.has_seq = True
+            self.offsets_start = HEADER_SIZE
+        else:
+            self.num_keys, self.bloom_size = struct.unpack('II', header[:8])
+            self.max_seq = 0
+            self.has_seq = False
+            self.offsets_start = 8
+        if not self.blocked:
+            self.bloom_offset = os.fstat(self.file.fileno()).st_size - self.bloom_size
+            self.filter_fpr = 0.01
+            self.min_seq = 0
+            self.range_deletes_applied = 0
+            self.blob_refs = {}
+
+    def _read_footer(self):
+        size = os.fstat(self.file.fileno()).st_size
+        (index_offset, index_size, self.bloom_offset, self.bloom_size,
+         props_offset, props_size) = FOOTER.unpack(self._read_at(size - FOOTER.size, FOOTER.size))
+        props = json.loads(self._read_at(props_offset, props_size))
+        self.num_keys = props['entries']
+        self.max_seq = props['max_seq']
+        self.restart_interval = props['restart_interval']
+        self.key_range = (from_json_key(props['min_key']), from_json_key(props['max_key']))
+        self.filter_fpr = props['filter_fpr']
+        self.min_seq = props['min_seq']
+        self.range_deletes_applied = props['range_deletes_applied']
+        self.blob_refs = {int(n): size for n, size in props['blob_refs'].items()}
+        self.has_seq = True
+        self.block_keys = []
+        self.block_offsets = []
+        self.block_sizes = []
+        self.block_starts = []
+        self.block_crcs = []
+        self.block_codecs = []
+        data = self._read_at(index_offset, index_size)
+        pos = 0
+        start = 0
+        while pos < len(data):
+            key_len = struct.unpack_from('I', data, pos)[0]
+            pos += 4
+            key = decode(data[pos:pos + (key_len & LENGTH_MASK)], key_len)
+            pos += key_len & LENGTH_MASK
+            offset, size, count, crc, codec_id = struct.unpack_from('QIIIB', data, pos)
+            pos += 21
+            self.block_keys.append(key)
+            self.block_offsets.append(offset)
+            self.block_sizes.append(size)
+            self.block_starts.append(start)
+            self.block_crcs.append(crc)
+            self.block_codecs.append(codec_id)
+            start += count
+
+    def _read_at(self, offset, size):
+        if self.mm is not None:
+            return self.mm[offset:offset + size]
+        self.file.seek(offset)
+        return self.file.read(size)
 
     def _load_bloom(self):
-        self.file.seek(-self.bloom_size, os.SEEK_END)
-        bloom_bytes = self.file.read(self.bloom_size)
-        self.bloom = BloomFilter.deserialize(bloom_bytes)
+        self.bloom = load_filter(self._read_at(self.bloom_offset, self.bloom_size)) if self.bloom_size else None
+
+    def _load_key_range(self):
+        if self.blocked:
+            self.min_key, self.max_key = self.key_range
+        elif self.num_keys:
+            self.min_key = self._entry_at(0)[0]
+            self.max_key = self._entry_at(self.num_keys - 1)[0]
+        else:
+            self.min_key = self.max_key = None
+
+    def _decode_block(self, b, data):
+        if zlib.crc32(data) != self.block_crcs[b]:
+            raise IOError(f"Checksum mismatch in block {b} of {self.path}")
+        decompress = DECOMPRESS[self.block_codecs[b]]
+        return decompress(data) if decompress is not None else data
+
+    def _load_block(self, b):
+        return self._decode_block(b, self._read_at(self.block_offsets[b], self.block_sizes[b]))
+
+    def _block(self, b):
+        if self.cache is None:
+            return Block(self._load_block(b), self.restart_interval)
+        block = self.cache.get((self.path, b))
+        if block is None:
+            block = Block(self._load_block(b), self.restart_interval)
+            self.cache.put((self.path, b), block, len(block.data))
+        return block
+
+    def _block_of(self, idx):
+        return bisect_right(self.block_starts, idx) - 1
+
+    def overlaps(self, start, end):
+        return self.num_keys > 0 and self.min_key <= end and self.max_key >= start
 
     def _get_offset(self, idx):
+        if self.mm is not None:
+            return self.offsets[idx]
         pos = self.offsets_start + idx * 8
         self.file.seek(pos)
         return struct.unpack('Q', self.file.read(8))[0]
 
-    def _read_key_value(self, offset):
+    def _read_key(self, offset):
         self.file.seek(offset)
         key_len = struct.unpack('I', self.file.read(4))[0]
-        key = self.file.read(key_len).decode('utf-8')
-        value_len = struct.unpack('I', self.file.read(4))[0]
-        value = self.file.read(value_len).decode('utf-8')
-        return key, value
+        return self.file.read(key_len).decode('utf-8')
 
-    def iter_index(self):
-        for idx in range(self.num_keys):
-            offset = self._get_offset(idx)
-            key, _ = self._read_key_value(offset)
-            yield key, offset
+    def _key_at(self, idx):
+        if self.mm is None:
+            return self._read_key(self._get_offset(idx))
+        offset = self.offsets[idx]
+        key_len = struct.unpack_from('I', self.mm, offset)[0]
+        return self.mm[offset + 4:offset + 4 + key_len]
+
+    def _probe(self, key):
+        return key if self.mm is None else key.encode('utf-8')
+
+    def _read_entry(self, f=None):
+        f = f or self.file
+        key_len = struct.unpack('I', f.read(4))[0]
+        key = f.read(key_len).decode('utf-8')
+        seq = struct.unpack('Q', f.read(8))[0] if self.has_seq else 0
+        value_len = struct.unpack('I', f.read(4))[0]
+        value = f.read(value_len).decode('utf-8')
+        return key, seq, value
+
+    def _parse_entry(self, offset):
+        mm = self.mm
+        key_len = struct.unpack_from('I', mm, offset)[0]
+        offset += 4
+        key = str(mm[offset:offset + key_len], 'utf-8')
+        offset += key_len
+        seq = 0
+        if self.has_seq:
+            seq = struct.unpack_from('Q', mm, offset)[0]
+            offset += 8
+        value_len = struct.unpack_from('I', mm, offset)[0]
+        offset += 4
+        value = str(mm[offset:offset + value_len], 'utf-8')
+        return (key, seq, value), offset + value_len
 
     def iter_items(self):
-        for idx in range(self.num_keys):
-            offset = self._get_offset(idx)
-            key, value = self._read_key_value(offset)
-            yield key, value
+        if self.blocked:
+            with open(self.path, 'rb') as f:
+                for b, (offset, size) in enumerate(zip(self.block_offsets, self.block_sizes)):
+                    f.seek(offset)
+                    yield from Block(self._decode_block(b, f.read(size)), self.restart_interval).iter_from(0)
+            return
+        if self.mm is not None:
+            offset = self.offsets_start + self.num_keys * 8
+            for _ in range(self.num_keys):
+                entry, offset = self._parse_entry(offset)
+                yield entry
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets_start + self.num_keys * 8)
+            for _ in range(self.num_keys):
+                yield self._read_entry(f)
 
-    def get(self, key):
-        if key not in self.bloom:
-            return None
-        l, r = 0, self.num_keys - 1
+    def _lower_bound(self, key):
+        return self._lower_bound_from(key, 0)
+
+    def _lower_bound_from(self, key, lo):
+        if self.blocked:
+            if not self.num_keys:
+                return 0
+            b = max(bisect_left(self.block_keys, key) - 1, 0)
+            return max(lo, self.block_starts[b] + self._block(b).lower_bound(key))
+        probe = self._probe(key)
+        l, r = lo, self.num_keys - 1
+        first = self.num_keys
         while l <= r:
             m = (l + r) // 2
-            offset = self._get_offset(m)
-            k, value = self._read_key_value(offset)
-            if k == key:
-                return value
-            elif k < key:
+            if self._key_at(m) < probe:
                 l = m + 1
             else:
+                first = m
                 r = m - 1
-        return None
+        return first
 
-    def range(self, start, end):
-        res = []
+    def _upper_bound(self, key):
+        if self.blocked:
+            b = bisect_right(self.block_keys, key) - 1
+            if b < 0:
+                return 0
+            return self.block_starts[b] + self._block(b).upper_bound(key)
+        probe = self._probe(key)
         l, r = 0, self.num_keys - 1
         first = self.num_keys
         while l <= r:
             m = (l + r) // 2
-            offset = self._get_offset(m)
-            k, _ = self._read_key_value(offset)
-            if k < start:
+            if self._key_at(m) <= probe:
                 l = m + 1
             else:
                 first = m
                 r = m - 1
-        idx = first
-        while idx < self.num_keys:
-            offset = self._get_offset(idx)
-            k, value = self._read_key_value(offset)
-            if k > end:
+        return first
+
+    def _entry_at(self, idx):
+        if self.blocked:
+            b = self._block_of(idx)
+            return next(self._block(b).iter_from(idx - self.block_starts[b]))
+        if self.mm is not None:
+            return self._parse_entry(self.offsets[idx])[0]
+        self.file.seek(self._get_offset(idx))
+        return self._read_entry()
+
+    def _entries_from(self, idx):
+        if not self.blocked:
+            for i in range(idx, self.num_keys):
+                yield self._entry_at(i)
+            return
+        if idx >= self.num_keys:
+            return
+        b = self._block_of(idx)
+        yield from self._block(b).iter_from(idx - self.block_starts[b])
+        for b in range(b + 1, len(self.block_keys)):
+            yield from self._block(b).iter_from(0)
+
+    def _entries_before(self, idx):
+        if not self.blocked:
+            for i in range(idx - 1, -1, -1):
+                yield self._entry_at(i)
+            return
+        if idx <= 0:
+            return
+        b = self._block_of(idx - 1)
+        entries = list(self._block(b).iter_from(0))
+        yield from reversed(entries[:idx - self.block_starts[b]])
+        for b in range(b - 1, -1, -1):
+            yield from reversed(list(self._block(b).iter_from(0)))
+
+    def cursor(self, start, end, reverse=False):
+        if not self.overlaps(start, end):
+            return
+        if not reverse:
+            for entry in self._entries_from(self._lower_bound(start)):
+                if entry[0] > end:
+                    break
+                yield entry
+            return
+        group = []
+        for entry in self._entries_before(self._upper_bound(end)):
+            if entry[0] < start:
                 break
-            if k < start:
-                idx += 1
-                continue
-            res.append((k, value))
-            idx += 1
+            if group and group[-1][0] != entry[0]:
+                yield from reversed(group)
+                group = []
+            group.append(entry)
+        yield from reversed(group)
+
+    def _versions_from(self, idx, key):
+        versions = []
+        for k, seq, value in self._entries_from(idx):
+            if k != key:
+                break
+            versions.append((seq, value))
+        return versions, idx + len(versions)
+
+    def versions(self, key):
+        if not self.overlaps(key, key) or (self.bloom is not None and key not in self.bloom):
+            return []
+        return self._versions_from(self._lower_bound(key), key)[0]
+
+    def multi_versions(self, keys):
+        if not self.num_keys:
+            return []
+        candidates = [k for k in keys if self.min_key <= k <= self.max_key]
+        if self.bloom is not None:
+            candidates = [k for k, hit in zip(candidates, self.bloom.contains_many(candidates)) if hit]
+        res = []
+        idx = 0
+        for key in candidates:
+            idx = self._lower_bound_from(key, idx)
+            if idx >= self.num_keys:
+                break
+            versions, idx = self._versions_from(idx, key)
+            if versions:
+                res.append((key, versions))
+        return res
+
+    def get(self, key):
+        versions = self.versions(key)
+        return versions[0][1] if versions else None
+
+    def entries(self, start, end):
+        return list(self.cursor(start, end))
+
+    def range(self, start, end):
+        res = []
+        for k, _, value in self.entries(start, end):
+            if not res or res[-1][0] != k:
+                res.append((k, value))
         return res
 
+    def ref(self):
+        self.refs += 1
+
+    def unref(self):
+        self.refs -= 1
+        if self.refs == 0 and self.obsolete:
+            self._remove()
+
+    def mark_obsolete(self):
+        self.obsolete = True
+        if self.refs == 0:
+            self._remove()
+
+    def _remove(self):
+        self.close()
+        if self.value_log is not None:
+            self.value_log.unref(self.blob_refs)
+        if self.blocked and self.cache is not None:
+            for b in range(len(self.block_keys)):
+                self.cache.erase((self.path, b))
+        os.remove(self.path)
+
     def close(self):
+        if self.mm is not None:
+            if not self.blocked:
+                self.offsets.release()
+            self.mm.close()
+            self.mm = None
         self.file.close()
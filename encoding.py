@@ -0,0 +1,45 @@
+import struct
+from collections import namedtuple
+
+BYTES_FLAG = 1 << 31
+POINTER_FLAG = 1 << 30
+LENGTH_MASK = POINTER_FLAG - 1
+
+
+class ValuePointer(namedtuple('ValuePointer', 'file offset size')):
+    STRUCT = struct.Struct('QQI')
+
+    def pack(self):
+        return self.STRUCT.pack(*self)
+
+    @classmethod
+    def unpack(cls, data):
+        return cls(*cls.STRUCT.unpack(data))
+
+
+def encode(obj):
+    if isinstance(obj, ValuePointer):
+        return obj.pack(), POINTER_FLAG
+    if isinstance(obj, (bytes, bytearray)):
+        return bytes(obj), BYTES_FLAG
+    return obj.encode('utf-8'), 0
+
+
+def decode(data, length):
+    if length & POINTER_FLAG:
+        return ValuePointer.unpack(data)
+    if length & BYTES_FLAG:
+        return bytes(data)
+    return str(data, 'utf-8')
+
+
+def json_key(key):
+    if isinstance(key, bytes):
+        return {'hex': key.hex()}
+    return key
+
+
+def from_json_key(obj):
+    if isinstance(obj, dict):
+        return bytes.fromhex(obj['hex'])
+    return obj
@@ -6,7 +6,9 @@ import fnmatch
 
 from pyroaring import BitMap
 
+from cache import LruCache
 from lsm_table import LsmTable
+from write_batch import WriteBatch
 from text_processor import (
     process as process_text,
     process_with_original,
@@ -14,32 +16,45 @@ from text_processor import (
 )
 
 
-def _encode_bitmap(bm: BitMap) -> str:
-    return base64.b64encode(bm.serialize()).decode('ascii')
+def _encode_bitmap(bm: BitMap) -> bytes:
+    return bm.serialize()
 
 
-def _decode_bitmap(s: str) -> BitMap:
-    return BitMap.deserialize(base64.b64decode(s))
+def _decode_bitmap(data: bytes | str) -> BitMap:
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    return BitMap.deserialize(data)
 
 
-def _bitmap_merge(a: str, b: str) -> str:
+def _bitmap_merge(a: bytes, b: bytes) -> bytes:
     return _encode_bitmap(_decode_bitmap(a) | _decode_bitmap(b))
 
 
+def _bitmap_merge_many(values: list[bytes]) -> bytes:
+    return _encode_bitmap(BitMap.union(*(_decode_bitmap(v) for v in values)))
+
+
 def _pairs_merge(a: str, b: str) -> str:
-    pairs = set(a.split('\n')) | set(b.split('\n'))
+    return _pairs_merge_many([a, b])
+
+
+def _pairs_merge_many(values: list[str]) -> str:
+    pairs = set()
+    for v in values:
+        pairs.update(v.split('\n'))
     return '\n'.join(sorted(pairs))
 
 
 def _positions_merge(a: str, b: str) -> str:
-    da = json.loads(a)
-    db = json.loads(b)
-    for doc_id, positions in db.items():
-        if doc_id in da:
-            da[doc_id] = sorted(set(da[doc_id]) | set(positions))
-        else:
-            da[doc_id] = positions
-    return json.dumps(da, separators=(',', ':'))
+    return _positions_merge_many([a, b])
+
+
+def _positions_merge_many(values: list[str]) -> str:
+    merged = {}
+    for v in values:
+        for doc_id, positions in json.loads(v).items():
+            merged.setdefault(doc_id, set()).update(positions)
+    return json.dumps({doc_id: sorted(p) for doc_id, p in merged.items()}, separators=(',', ':'))
 
 
 def _generate_ngrams(term: str) -> list[str]:
@@ -189,15 +204,22 @@ class QueryParser:
         return _TermNode(stem)
 
 class InvertedIndex:
-    def __init__(self, directory: str, r: int = 10, l: int = 1000):
+    def __init__(self, directory: str, r: int = 10, l: int = 1000, block_cache_size: int = 32 << 20,
+                 compression: str | None = None, row_cache_size: int = 0, value_threshold: int | None = None):
         self.directory = directory
-        self.lsm = LsmTable(directory, r=r, l=l, merge_fn=_bitmap_merge)
+        self.block_cache = LruCache(block_cache_size)
+        self.lsm = LsmTable(directory, r=r, l=l, merge_fn=_bitmap_merge, merge_many=_bitmap_merge_many,
+                            block_cache=self.block_cache, compression=compression, row_cache_size=row_cache_size)
         kgram_dir = os.path.join(directory, 'kgram')
-        self.kgram_lsm = LsmTable(kgram_dir, r=r, l=l, merge_fn=_pairs_merge)
+        self.kgram_lsm = LsmTable(kgram_dir, r=r, l=l, merge_fn=_pairs_merge, merge_many=_pairs_merge_many,
+                                  block_cache=self.block_cache, compression=compression)
         bsi_dir = os.path.join(directory, 'bsi')
-        self.bsi_lsm = LsmTable(bsi_dir, r=r, l=l, merge_fn=_bitmap_merge)
+        self.bsi_lsm = LsmTable(bsi_dir, r=r, l=l, merge_fn=_bitmap_merge, merge_many=_bitmap_merge_many,
+                                block_cache=self.block_cache, compression=compression)
         pos_dir = os.path.join(directory, 'pos')
-        self.pos_lsm = LsmTable(pos_dir, r=r, l=l, merge_fn=_positions_merge)
+        self.pos_lsm = LsmTable(pos_dir, r=r, l=l, merge_fn=_positions_merge, merge_many=_positions_merge_many,
+                                block_cache=self.block_cache, compression=compression,
+                                value_threshold=value_threshold)
         self.all_docs = BitMap()
         self._load_all_docs()
 
@@ -222,23 +244,28 @@ class InvertedIndex:
         pairs = process_with_original(text)
         seen_stems: set[str] = set()
         seen_words: set[str] = set()
+        encoded = _encode_bitmap(BitMap([doc_id]))
+        postings = WriteBatch()
+        kgrams = WriteBatch()
         for original, stem in pairs:
             if stem not in seen_stems:
                 seen_stems.add(stem)
-                bm = BitMap([doc_id])
-                await self.lsm.insert(stem, _encode_bitmap(bm))
+                postings.put(stem, encoded)
             if original not in seen_words:
                 seen_words.add(original)
                 for ngram in _generate_ngrams(original):
-                    await self.kgram_lsm.insert(ngram, f"{original}\t{doc_id}")
+                    kgrams.put(ngram, f"{original}\t{doc_id}")
+        await self.lsm.write(postings)
+        await self.kgram_lsm.write(kgrams)
         terms_with_pos, new_offset = process_with_positions(text, _pos_offset)
         stem_positions: dict[str, list[int]] = {}
         for stem, pos in terms_with_pos:
             stem_positions.setdefault(stem, []).append(pos)
         doc_key = str(doc_id)
-        for stem, positions in stem_positions.items():
-            pos_data = json.dumps({doc_key: positions}, separators=(',', ':'))
-            await self.pos_lsm.insert(stem, pos_data)
+        await self.pos_lsm.insert_many(
+            (stem, json.dumps({doc_key: positions}, separators=(',', ':')))
+            for stem, positions in stem_positions.items()
+        )
         if start_date is not None:
             await self._index_bsi(doc_id, "start", start_date)
         if end_date is not None:
@@ -247,10 +274,12 @@ class InvertedIndex:
 
     async def _index_bsi(self, doc_id: int, prefix: str, value: int):
         encoded = _encode_bitmap(BitMap([doc_id]))
-        await self.bsi_lsm.insert(f"has_{prefix}", encoded)
+        batch = WriteBatch()
+        batch.put(f"has_{prefix}", encoded)
         for i in range(BSI_BITS):
             if (value >> i) & 1:
-                await self.bsi_lsm.insert(f"{prefix}:{i}", encoded)
+                batch.put(f"{prefix}:{i}", encoded)
+        await self.bsi_lsm.write(batch)
 
     async def add_file(self, doc_id: int, path: str,
                        start_date: int | None = None,
@@ -265,8 +294,22 @@ class InvertedIndex:
             for line in f:
                 offset = await self.add_document(doc_id, line, _pos_offset=offset)
 
-    async def get_posting(self, term: str) -> BitMap:
-        val = await self.lsm.get(term)
+    def snapshot(self) -> dict:
+        return {table: table.snapshot() for table in (self.lsm, self.kgram_lsm, self.bsi_lsm, self.pos_lsm)}
+
+    @staticmethod
+    def release(snapshots: dict):
+        for snap in snapshots.values():
+            snap.release()
+
+    async def _get(self, table: LsmTable, key: str, snapshots: dict | None = None):
+        return await table.get(key, snapshot=snapshots[table] if snapshots else None)
+
+    async def _get_many(self, table: LsmTable, keys: list[str], snapshots: dict | None = None):
+        return await table.multi_get(keys, snapshot=snapshots[table] if snapshots else None)
+
+    async def get_posting(self, term: str, snapshots: dict | None = None) -> BitMap:
+        val = await self._get(self.lsm, term, snapshots)
         if val is None:
             return BitMap()
         return _decode_bitmap(val)
@@ -276,77 +319,89 @@ class InvertedIndex:
         if not tokens:
             return []
         ast = QueryParser(tokens).parse()
-        result = await self._evaluate(ast)
+        snapshots = self.snapshot()
+        try:
+            result = await self._evaluate(ast, snapshots)
+        finally:
+            self.release(snapshots)
         return sorted(result)
 
-    async def _evaluate(self, node: _QueryNode) -> BitMap:
+    async def _evaluate(self, node: _QueryNode, snapshots: dict | None = None) -> BitMap:
         if isinstance(node, _TermNode):
-            return await self.get_posting(node.term)
+            return await self.get_posting(node.term, snapshots)
         if isinstance(node, _NotNode):
-            child = await self._evaluate(node.child)
+            child = await self._evaluate(node.child, snapshots)
             return self.all_docs - child
         if isinstance(node, _BinOpNode):
-            left = await self._evaluate(node.left)
-            right = await self._evaluate(node.right)
+            left = await self._evaluate(node.left, snapshots)
+            right = await self._evaluate(node.right, snapshots)
             if node.op == 'AND':
                 return left & right
             return left | right
         if isinstance(node, _PhraseNode):
-            return await self._phrase_bitmap(node.phrase)
+            return await self._phrase_bitmap(node.phrase, snapshots)
         if isinstance(node, _DateRangeNode):
             if node.kind == 'VALID':
-                return await self._valid_bitmap(node.date_from, node.date_to)
+                return await self._valid_bitmap(node.date_from, node.date_to, snapshots)
             if node.kind == 'APPEARED':
-                return await self._appeared_bitmap(node.date_from, node.date_to)
+                return await self._appeared_bitmap(node.date_from, node.date_to, snapshots)
         return BitMap()
 
-    async def _fetch_bsi_slices(self, prefix: str) -> list[BitMap]:
-        slices = []
-        for i in range(BSI_BITS):
-            val = await self.bsi_lsm.get(f"{prefix}:{i}")
-            slices.append(_decode_bitmap(val) if val else BitMap())
-        return slices
+    async def _fetch_bsi_slices(self, prefix: str, snapshots: dict | None = None) -> list[BitMap]:
+        keys = [f"{prefix}:{i}" for i in range(BSI_BITS)]
+        values = await self._get_many(self.bsi_lsm, keys, snapshots)
+        return [_decode_bitmap(val) if val else BitMap() for val in values]
 
-    async def _fetch_has(self, prefix: str) -> BitMap:
-        val = await self.bsi_lsm.get(f"has_{prefix}")
+    async def _fetch_has(self, prefix: str, snapshots: dict | None = None) -> BitMap:
+        val = await self._get(self.bsi_lsm, f"has_{prefix}", snapshots)
         return _decode_bitmap(val) if val else BitMap()
 
-    async def _appeared_bitmap(self, date_from: int, date_to: int) -> BitMap:
-        has_start = await self._fetch_has("start")
+    async def _appeared_bitmap(self, date_from: int, date_to: int,
+                               snapshots: dict | None = None) -> BitMap:
+        has_start = await self._fetch_has("start", snapshots)
         if not has_start:
             return BitMap()
-        slices = await self._fetch_bsi_slices("start")
+        slices = await self._fetch_bsi_slices("start", snapshots)
         return _bsi_range_between(slices, has_start, date_from, date_to)
 
-    async def _valid_bitmap(self, date_from: int, date_to: int) -> BitMap:
-        has_start = await self._fetch_has("start")
+    async def _valid_bitmap(self, date_from: int, date_to: int,
+                            snapshots: dict | None = None) -> BitMap:
+        has_start = await self._fetch_has("start", snapshots)
         if not has_start:
             return BitMap()
-        start_slices = await self._fetch_bsi_slices("start")
+        start_slices = await self._fetch_bsi_slices("start", snapshots)
         started_before_query = _bsi_range_lte(start_slices, has_start, date_from)
 
-        has_end = await self._fetch_has("end")
+        has_end = await self._fetch_has("end", snapshots)
         no_end = has_start - has_end
-        end_slices = await self._fetch_bsi_slices("end")
+        end_slices = await self._fetch_bsi_slices("end", snapshots)
         ends_after_query = _bsi_range_gte(end_slices, has_end, date_to)
 
         return started_before_query & (no_end | ends_after_query)
 
     async def search_valid(self, date_from: int, date_to: int) -> list[int]:
-        return sorted(await self._valid_bitmap(date_from, date_to))
+        snapshots = self.snapshot()
+        try:
+            return sorted(await self._valid_bitmap(date_from, date_to, snapshots))
+        finally:
+            self.release(snapshots)
 
     async def search_appeared(self, date_from: int, date_to: int) -> list[int]:
-        return sorted(await self._appeared_bitmap(date_from, date_to))
+        snapshots = self.snapshot()
+        try:
+            return sorted(await self._appeared_bitmap(date_from, date_to, snapshots))
+        finally:
+            self.release(snapshots)
 
-    async def _phrase_bitmap(self, phrase: str) -> BitMap:
+    async def _phrase_bitmap(self, phrase: str, snapshots: dict | None = None) -> BitMap:
         terms_with_pos, _ = process_with_positions(phrase)
         if not terms_with_pos:
             return BitMap()
         if len(terms_with_pos) == 1:
-            return await self.get_posting(terms_with_pos[0][0])
+            return await self.get_posting(terms_with_pos[0][0], snapshots)
         postings: list[dict[str, list[int]]] = []
-        for stem, _ in terms_with_pos:
-            val = await self.pos_lsm.get(stem)
+        values = await self._get_many(self.pos_lsm, [stem for stem, _ in terms_with_pos], snapshots)
+        for val in values:
             if val is None:
                 return BitMap()
             postings.append(json.loads(val))
@@ -369,7 +424,11 @@ class InvertedIndex:
         return result
 
     async def phrase_search(self, phrase: str) -> list[int]:
-        return sorted(await self._phrase_bitmap(phrase))
+        snapshots = self.snapshot()
+        try:
+            return sorted(await self._phrase_bitmap(phrase, snapshots))
+        finally:
+            self.release(snapshots)
 
     async def wildcard_search(self, pattern: str) -> list[tuple[str, int]]:
         pattern = pattern.lower()
@@ -387,15 +446,16 @@ class InvertedIndex:
         if not ngrams:
             return []
         candidates: set[str] | None = None
-        for ng in ngrams:
-            val = await self.kgram_lsm.get(ng)
-            entries = set(val.split('\n')) if val else set()
-            if candidates is None:
-                candidates = entries
-            else:
-                candidates &= entries
-            if not candidates:
-                return []
+        with self.kgram_lsm.snapshot() as snap:
+            for ng in ngrams:
+                val = await self.kgram_lsm.get(ng, snapshot=snap)
+                entries = set(val.split('\n')) if val else set()
+                if candidates is None:
+                    candidates = entries
+                else:
+                    candidates &= entries
+                if not candidates:
+                    return []
 
         full_pattern = '^' + pattern + '$'
         result: list[tuple[str, int]] = []
@@ -415,3 +475,7 @@ class InvertedIndex:
         await self.bsi_lsm.flush()
         await self.pos_lsm.flush()
         self._save_all_docs()
+
+    async def close(self):
+        for table in (self.lsm, self.kgram_lsm, self.bsi_lsm, self.pos_lsm):
+            await table.close()
@@ -1,10 +1,24 @@
 import heapq
+import itertools
 import os
 import asyncio
+import re
+import pickle
+import time
+from contextlib import nullcontext
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from memtable import Memtable
-from component import DiskComponent
-from bloom_filter import BloomFilter
-import struct
+from bloom_filter import FILTERS, UniformFilterPolicy
+from cache import LruCache
+from component import DiskComponent, fsync_dir, CODECS
+from encoding import json_key, from_json_key, ValuePointer
+from manifest import Manifest
+from version import Version
+from snapshot import SnapshotList
+from value_log import ValueLog
+from wal import WriteAheadLog
+from write_batch import WriteBatch
 
 class LsmTable:
     async def print_all_keys(self):
@@ -12,226 +26,854 @@ class LsmTable:
         for level, comps in enumerate(self.levels):
             for comp in reversed(comps):
                 print(f'Level {level}, file: {getattr(comp, "path", None)}')
-                for k, v in comp.iter_items():
-                    print(k, v)
+                for k, seq, v in comp.iter_items():
+                    print(k, seq, v)
 
     async def _maybe_merge(self, level):
-        while len(self.levels[level]) > self.r:
-            async with self.locks[level]:
-                next_level = level + 1
-                next_dir = os.path.join(self.directory, f"level{next_level}")
-                os.makedirs(next_dir, exist_ok=True)
-                comp_id = len(os.listdir(next_dir))
-                out_path = os.path.join(next_dir, f"comp_{comp_id}.dat")
-                await self._merge_components(self.levels[level], out_path)
-                for comp in self.levels[level]:
-                    comp.file.close()
-                    os.remove(comp.path)
-                self.levels[level] = []
-                if next_level >= len(self.levels):
-                    self.levels.append([])
-                    self.locks.append(asyncio.Lock())
-                self.levels[next_level].insert(0, DiskComponent(out_path))
+        if self.compaction == 'leveled':
+            await self._maybe_compact_leveled(level)
+            return
+        while len(self.version.level(level)) > self.r:
+            async with self._compaction_lock:
+                with self._acquire() as version:
+                    inputs = list(version.level(level))
+                    next_level = level + 1
+                    bottommost = not any(version.level(i) for i in range(next_level, len(version.levels)))
+                    out = await self._compact(inputs, next_level, None, bottommost)
+                    self._install(level, inputs, next_level, [], out)
             await self._maybe_merge(next_level)
 
-    async def _merge_components(self, components, out_path):
-        iters = [comp.iter_items() for comp in components]
+    async def _maybe_compact_leveled(self, level):
+        while True:
+            async with self._compaction_lock:
+                with self._acquire() as version:
+                    comps = version.level(level)
+                    if level == 0:
+                        if len(comps) <= self.r:
+                            return
+                        inputs = list(comps)
+                    else:
+                        if sum(c.num_keys for c in comps) <= self._level_capacity(level):
+                            return
+                        inputs = [self._pick_compaction_file(comps, level)]
+                    next_level = level + 1
+                    lo = min(c.min_key for c in inputs)
+                    hi = max(c.max_key for c in inputs)
+                    overlapping = [c for c in version.level(next_level) if c.overlaps(lo, hi)]
+                    out_lo = min(c.min_key for c in inputs + overlapping)
+                    out_hi = max(c.max_key for c in inputs + overlapping)
+                    bottommost = not any(
+                        c.overlaps(out_lo, out_hi)
+                        for i in range(next_level + 1, len(version.levels)) for c in version.level(i)
+                    )
+                    out = await self._compact(inputs + overlapping, next_level, self.target_file_size, bottommost)
+                    self._install(level, inputs, next_level, overlapping, out)
+            self._compact_pointer[level] = hi
+            await self._maybe_compact_leveled(next_level)
+
+    async def gc_value_log(self):
+        if self.value_log is None:
+            return
+        async with self._compaction_lock:
+            with self._acquire() as version:
+                live = {}
+                for comp in version.components():
+                    for number, size in comp.blob_refs.items():
+                        live[number] = live.get(number, 0) + size
+                victims = {
+                    number for number in self.value_log.sealed()
+                    if 0 < live.get(number, 0) <= self.value_log.sizes[number] * (1 - self.blob_gc_ratio)
+                }
+                if not victims:
+                    return
+                for level, comps in enumerate(version.levels):
+                    for comp in comps:
+                        if victims.isdisjoint(comp.blob_refs):
+                            continue
+                        out = await self._run_in_pool(
+                            self._write_component, level, comp.iter_items(), comp.range_deletes_applied, victims
+                        )
+                        self._install_rewrite(level, comp, out)
+
+    def _install_rewrite(self, level, comp, out):
+        name = self._relpath(comp)
+        record = self._record(out)
+        record['seq'] = next(r['seq'] for r in self.manifest.levels[level] if r['file'] == name)
+        self.manifest.log(add=[(level, record)], delete=[(level, name)])
+        levels = [list(comps) for comps in self.version.levels]
+        levels[level] = [out if c is comp else c for c in levels[level]]
+        self._publish(levels=levels)
+        comp.mark_obsolete()
+
+    async def _compact(self, inputs, level, max_keys, bottommost):
+        snapshots = self._snapshots.frozen()
+        tombstones = list(self.range_deletes)
+        n = min(self.subcompactions, sum(c.num_keys for c in inputs) // self.l)
+        if n <= 1 or self.compaction != 'leveled':
+            return await self._run_in_pool(
+                self._merge_components, inputs, level, max_keys, snapshots, tombstones, bottommost
+            )
+        loop = asyncio.get_running_loop()
+        prefix = self._new_component_path(level)[:-len('.dat')]
+        paths = [c.path for c in inputs]
+        fpr = self.level_fprs(level)[level]
+        applied = self._applied_range_deletes(tombstones, snapshots)
+        out = []
+        with self._pin_value_log():
+            jobs = [
+                loop.run_in_executor(self._subcompaction_pool, _run_subcompaction, self, paths, key_range,
+                                     f"{prefix}_{i}", level, max_keys, snapshots, tombstones, bottommost, fpr,
+                                     applied)
+                for i, key_range in enumerate(self._subcompaction_bounds(inputs, n))
+            ]
+            for written in await asyncio.gather(*jobs):
+                for tmp_path in written:
+                    path = self._new_component_path(level)
+                    os.replace(tmp_path, path)
+                    out.append(self._open_component(path))
+            if out:
+                fsync_dir(os.path.dirname(out[0].path))
+        return out
+
+    @staticmethod
+    def _subcompaction_bounds(inputs, n):
+        keys = sorted({k for c in inputs for k in (c.block_keys if c.blocked else (c.min_key, c.max_key))
+                       if k is not None})
+        if len(keys) < 2:
+            return [(None, None)]
+        splits = sorted({keys[len(keys) * i // n] for i in range(1, n)} - {keys[0]})
+        bounds = [None] + splits + [None]
+        return list(zip(bounds, bounds[1:]))
+
+    def _picklable(self):
+        if self.value_log is not None:
+            return False
+        try:
+            pickle.dumps(self)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return False
+        return True
+
+    def __getstate__(self):
+        # Only the merge configuration crosses into subcompaction worker processes.
+        state = {name: self.__dict__[name] for name in (
+            'merge_fn', 'merge_many', 'compaction_filter', 'ttl', 'seq_times', 'block_size', 'compression',
+            'filter_type',
+        )}
+        state['value_log'] = None
+        return state
+
+    async def _run_in_pool(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _install(self, level, inputs, next_level, replaced, out):
+        self.manifest.log(
+            add=[(next_level, self._record(c)) for c in out],
+            delete=[(level, self._relpath(c)) for c in inputs] +
+                   [(next_level, self._relpath(c)) for c in replaced],
+        )
+        levels = [list(comps) for comps in self.version.levels]
+        while next_level >= len(levels):
+            levels.append([])
+        levels[level] = [c for c in levels[level] if c not in inputs]
+        kept = [c for c in levels[next_level] if c not in replaced]
+        if self.compaction == 'leveled':
+            levels[next_level] = sorted(kept + out, key=lambda c: c.min_key)
+        else:
+            levels[next_level] = out + kept
+        self._publish(levels=levels)
+        if self.compaction_filter is not None and self.row_cache is not None:
+            self.row_cache.clear()
+        for comp in inputs + replaced:
+            comp.mark_obsolete()
+        self._gc_range_deletes()
+
+    def _publish(self, **changes):
+        old = self.version
+        fields = {'memtable': old.memtable, 'immutable': old.immutable, 'levels': old.levels}
+        fields.update(changes)
+        self.version = Version(**fields).ref()
+        old.unref()
+
+    def _acquire(self):
+        return self.version.ref()
+
+    @property
+    def memtable(self):
+        return self.version.memtable
+
+    @property
+    def immutable(self):
+        return self.version.immutable
+
+    @property
+    def levels(self):
+        return self.version.levels
+
+    def _level_capacity(self, level):
+        return self.l * self.r ** level
+
+    def _pick_compaction_file(self, comps, level):
+        pointer = self._compact_pointer.get(level)
+        if pointer is not None:
+            for comp in comps:
+                if comp.min_key > pointer:
+                    return comp
+        return comps[0]
+
+    def _new_component_path(self, level):
+        level_dir = os.path.join(self.directory, f"level{level}")
+        os.makedirs(level_dir, exist_ok=True)
+        comp_id = self.manifest.new_file_number()
+        return os.path.join(level_dir, f"comp_{comp_id}.dat")
+
+    def _merge_iter(self, components, snapshots, tombstones=(), bottommost=False, level=0, key_range=None):
+        now = time.time()
+        if key_range is None:
+            iters = [comp.iter_items() for comp in components]
+        else:
+            iters = [self._range_items(comp, *key_range) for comp in components]
         heap = []
         for idx, it in enumerate(iters):
             try:
-                k, v = next(it)
-                heap.append((k, idx, v))
+                k, seq, v = next(it)
+                heap.append((k, -seq, idx, v))
             except StopIteration:
                 pass
         heapq.heapify(heap)
-        offsets_path = out_path + '.offsets.tmp'
-        data_path = out_path + '.data.tmp'
-        offsets_file = open(offsets_path, 'wb')
-        data_file = open(data_path, 'wb')
-        offset = 0
-        bloom_keys = []
-        num_keys = 0
 
         last_key = None
-        last_value = None
-
-        def _write_buffered():
-            nonlocal offset, num_keys
-            k_bytes = last_key.encode('utf-8')
-            v_bytes = last_value.encode('utf-8')
-            chunk = (
-                struct.pack('I', len(k_bytes)) + k_bytes +
-                struct.pack('I', len(v_bytes)) + v_bytes
-            )
-            offsets_file.write(struct.pack('Q', offset))
-            data_file.write(chunk)
-            bloom_keys.append(last_key)
-            num_keys += 1
-            offset += len(chunk)
-
+        last_seq = None
+        run = []
+        runs = []
         while heap:
-            k, idx, v = heapq.heappop(heap)
-            if k == last_key:
-                if self.merge_fn:
-                    last_value = self.merge_fn(last_value, v)
-            else:
-                if last_key is not None:
-                    _write_buffered()
-                last_key = k
-                last_value = v
+            k, neg_seq, idx, v = heapq.heappop(heap)
+            seq = -neg_seq
             try:
-                k2, v2 = next(iters[idx])
-                heapq.heappush(heap, (k2, idx, v2))
+                k2, seq2, v2 = next(iters[idx])
+                heapq.heappush(heap, (k2, -seq2, idx, v2))
             except StopIteration:
                 pass
+            if tombstones and self._range_deleted(k, seq, tombstones, snapshots):
+                continue
+            if self.ttl is not None and self._expired(seq, now):
+                continue
+            if k == last_key and not snapshots.has_between(seq, last_seq):
+                if self.merge_fn:
+                    run.append(v)
+                continue
+            if k != last_key:
+                if run:
+                    runs.append((last_key, last_seq, self._combine(run)))
+                yield from self._finish_runs(runs, level, bottommost, snapshots)
+                runs = []
+            elif run:
+                runs.append((last_key, last_seq, self._combine(run)))
+            last_key = k
+            last_seq = seq
+            run = [v]
+
+        if run:
+            runs.append((last_key, last_seq, self._combine(run)))
+        yield from self._finish_runs(runs, level, bottommost, snapshots)
+
+    @staticmethod
+    def _range_items(comp, start, end):
+        if comp.min_key is None:
+            return
+        for entry in comp.cursor(comp.min_key if start is None else start, comp.max_key):
+            if end is not None and entry[0] >= end:
+                return
+            yield entry
+
+    def _finish_runs(self, runs, level, bottommost, snapshots):
+        if self.compaction_filter is not None and runs and not (len(snapshots) and snapshots.seqs[-1] >= runs[0][1]):
+            runs[:1] = self._filter_run(runs[0], level, bottommost and len(runs) == 1)
+        if bottommost and not self.merge_fn:
+            while runs and runs[-1][2] == '<DELETED>':
+                runs.pop()
+        return runs
+
+    def _filter_run(self, run, level, last):
+        key, seq, value = run
+        if not self.merge_fn and value == '<DELETED>':
+            return [run]
+        existing = self._resolve(value)
+        new_value = self.compaction_filter(level, key, existing)
+        if new_value is existing:
+            return [run]
+        if new_value is not None:
+            return [(key, seq, new_value)]
+        if last:
+            return []
+        if self.merge_fn:
+            return [run]
+        return [(key, seq, '<DELETED>')]
+
+    def _expired(self, seq, now):
+        times = self.seq_times
+        i = bisect_left(times, seq, key=lambda t: t[0]) - 1
+        if i < 0:
+            return False
+        # A sample is taken at least every ttl / 100 seconds of writes, so the write
+        # happened no later than that or the next sample, whichever comes first.
+        written = times[i][1] + self.ttl / 100
+        if i + 1 < len(times):
+            written = min(written, times[i + 1][1])
+        return written + self.ttl <= now
+
+    def _note_time(self):
+        now = time.time()
+        if self.seq_times and now - self.seq_times[-1][1] < self.ttl / 100:
+            return
+        self.manifest.log(seq_times=[(self.last_seq, now)])
+        times = self.seq_times + [(self.last_seq, now)]
+        i = bisect_right(times, now - self.ttl, key=lambda t: t[1]) - 1
+        if i > 0:
+            times = [(times[0][0], times[i][1])] + times[i + 1:]
+        self.seq_times = self.manifest.seq_times = times
+
+    @staticmethod
+    def _range_deleted(key, seq, tombstones, snapshots):
+        for start, end, t in tombstones:
+            if start <= key <= end and seq < t and not snapshots.has_between(seq, t):
+                return True
+        return False
+
+    @staticmethod
+    def _applied_range_deletes(tombstones, snapshots):
+        oldest = snapshots.seqs[0] if len(snapshots) else None
+        return max((t for _, _, t in tombstones if oldest is None or t <= oldest), default=0)
+
+    @staticmethod
+    def _range_floor(key, seq, tombstones):
+        floor = 0
+        for start, end, t in tombstones:
+            if start <= key <= end and (seq is None or t <= seq) and t > floor:
+                floor = t
+        return floor
+
+    def _merge_components(self, components, level, max_keys=None, snapshots=None, tombstones=(),
+                          bottommost=False):
+        snapshots = snapshots or SnapshotList()
+        items = self._merge_iter(components, snapshots, tombstones, bottommost, level)
+        applied = self._applied_range_deletes(tombstones, snapshots)
+        out = []
+        for chunk in self._chunks(items, max_keys):
+            comp = self._write_component(level, chunk, applied)
+            if comp.num_keys:
+                out.append(comp)
+            else:
+                comp.mark_obsolete()
+        return out
+
+    @staticmethod
+    def _chunks(items, max_keys):
+        if max_keys is None:
+            yield items
+            return
+        chunk = []
+        for item in items:
+            if len(chunk) >= max_keys and item[0] != chunk[-1][0]:
+                yield chunk
+                chunk = []
+            chunk.append(item)
+        if chunk:
+            yield chunk
+
+    def _write_component(self, level, items, range_deletes_applied=0, relocate=()):
+        with self._pin_value_log():
+            return self._write_items(self._new_component_path(level), items, self.level_fprs(level)[level],
+                                     range_deletes_applied, relocate, **self._component_options)
+
+    def _pin_value_log(self):
+        return self.value_log.pinned() if self.value_log is not None else nullcontext()
+
+    def _write_items(self, path, items, filter_fpr, range_deletes_applied=0, relocate=(), **options):
+        if self.value_log is not None:
+            items = self._separate(items, relocate)
+        comp = DiskComponent.write(path, items, block_size=self.block_size, compression=self.compression,
+                                   filter_type=self.filter_type, filter_fpr=filter_fpr,
+                                   range_deletes_applied=range_deletes_applied, **options)
+        if self.value_log is not None:
+            self.value_log.flush()
+        return comp
+
+    def _separate(self, items, relocate=()):
+        for k, seq, v in items:
+            if isinstance(v, ValuePointer):
+                if v.file in relocate:
+                    v = self.value_log.put(k, self.value_log.read(v))
+            elif v != '<DELETED>':
+                v = self.value_log.put(k, v)
+            yield k, seq, v
+
+    def _resolve(self, value):
+        if isinstance(value, ValuePointer):
+            return self.value_log.read(value)
+        return value
+
+    def level_fprs(self, level=0):
+        depth = max([level] + [i for i, comps in enumerate(self.version.levels) if comps])
+        return self.filter_policy.level_fprs(depth + 1, self.r)
 
-        if last_key is not None:
-            _write_buffered()
-
-        offsets_file.close()
-        data_file.close()
-        bloom_size, num_hashes = BloomFilter.optimal_size(num_keys, 0.01)
-        bloom = BloomFilter(bloom_size, num_hashes)
-        for k in bloom_keys:
-            bloom.add(k)
-        bloom_bytes = bloom.serialize()
-        with open(out_path, 'wb') as f:
-            f.write(struct.pack('II', num_keys, len(bloom_bytes)))
-            with open(offsets_path, 'rb') as off_f:
-                for _ in range(num_keys):
-                    off = struct.unpack('Q', off_f.read(8))[0]
-                    f.write(struct.pack('Q', off + 8 + num_keys * 8))
-            with open(data_path, 'rb') as data_f:
-                while True:
-                    chunk = data_f.read(4096)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-            f.write(bloom_bytes)
-        os.remove(offsets_path)
-        os.remove(data_path)
+    def expected_io(self):
+        with self._acquire() as version:
+            levels = [
+                max((c.filter_fpr for c in comps), default=0) if self.compaction == 'leveled' and i > 0
+                else sum(c.filter_fpr for c in comps)
+                for i, comps in enumerate(version.levels)
+            ]
+        return {'levels': levels, 'total': sum(levels)}
+
+    def _open_component(self, path, key_range=None):
+        return DiskComponent(path, key_range=key_range, **self._component_options)
         
-    def __init__(self, directory, r=10, l=1000, merge_fn=None):
+    def __init__(self, directory, r=10, l=1000, merge_fn=None, wal=False, background_flush=False,
+                 compaction='tiered', target_file_size=None, compaction_workers=1, mmap_reads=False,
+                 block_size=4096, block_cache_size=8 << 20, block_cache=None, compression=None,
+                 filter_type='bloom', filter_policy=None, row_cache_size=0, merge_many=None,
+                 partial_merge=None, value_threshold=None, blob_file_size=64 << 20, blob_gc_ratio=0.5,
+                 compaction_filter=None, ttl=None, subcompactions=1):
+        if compaction not in ('tiered', 'leveled'):
+            raise ValueError(f"Unknown compaction strategy: {compaction}")
+        if compression not in CODECS:
+            raise ValueError(f"Unknown compression: {compression}")
+        if filter_type not in FILTERS:
+            raise ValueError(f"Unknown filter type: {filter_type}")
         self.directory = directory
         self.r = r 
         self.l = l
-        self.merge_fn = merge_fn
-        self.memtable = Memtable(l, merge_fn=merge_fn)
-        self.levels = []
-        self.locks = []
+        if merge_many is not None and merge_fn is None:
+            merge_fn = lambda a, b: merge_many([a, b])
+        self.merge_fn = partial_merge or merge_fn
+        self.merge_many = merge_many
+        self.compaction_filter = compaction_filter
+        self.ttl = ttl
+        self.compaction = compaction
+        self.target_file_size = target_file_size or l
+        self._compact_pointer = {}
+        self._compaction_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=compaction_workers)
+        self.block_size = block_size
+        self.compression = compression
+        self.filter_type = filter_type
+        self.filter_policy = filter_policy or UniformFilterPolicy()
+        self.row_cache = LruCache(row_cache_size) if row_cache_size else None
+        self.block_cache = block_cache if block_cache is not None else LruCache(block_cache_size)
+        self.value_log = None
+        if value_threshold is not None:
+            self.value_log = ValueLog(os.path.join(directory, 'vlog'), value_threshold, blob_file_size)
+        self.blob_gc_ratio = blob_gc_ratio
+        self._component_options = {'use_mmap': mmap_reads, 'cache': self.block_cache, 'value_log': self.value_log}
+        self.version = None
+        self.last_seq = 0
+        self.range_deletes = []
+        self._snapshots = SnapshotList()
+        self.background_flush = background_flush
+        self._flush_task = None
+        self._flush_segment = None
+        self._flush_error = None
+        self._compaction_task = None
+        self.wal = None
+        self.use_wal = wal
         self._init_storage()
+        self.subcompactions = subcompactions
+        self._subcompaction_pool = None
+        if subcompactions > 1:
+            pool = ProcessPoolExecutor if self._picklable() else ThreadPoolExecutor
+            self._subcompaction_pool = pool(max_workers=subcompactions)
   
 
     def _init_storage(self):
         os.makedirs(self.directory, exist_ok=True)
         
-        self.levels = []
-        self.locks = []
+        self.manifest = Manifest(self.directory)
+        if self.manifest.exists():
+            self.manifest.load()
+            levels = []
+            for level, records in enumerate(self.manifest.levels):
+                levels.append([
+                    self._open_component(os.path.join(self.directory, r['file']),
+                                         key_range=(from_json_key(r['min']), from_json_key(r['max'])))
+                    for r in self._order_records(level, records)
+                ])
+            self._remove_orphans()
+            if self.value_log is not None:
+                self.value_log.remove_unreferenced()
+        else:
+            levels = self._load_legacy_levels()
+        self.last_seq = max([self.manifest.last_seq] + [c.max_seq for comps in levels for c in comps])
+        self.range_deletes = list(self.manifest.range_deletes)
+        self.seq_times = list(self.manifest.seq_times)
+        memtable = self._new_memtable()
+        self.version = Version(memtable, None, levels).ref()
+        if self.use_wal:
+            self.wal = WriteAheadLog(os.path.join(self.directory, "wal"))
+            flushed = max([self.manifest.flushed_seq] + [c.max_seq for comps in levels for c in comps])
+            for k, v, seq in self.wal.replay():
+                if seq <= flushed:
+                    continue
+                memtable.put(k, v, seq)
+                self.last_seq = max(self.last_seq, seq)
+
+    def _new_memtable(self):
+        return Memtable(self.l, merge_fn=self.merge_fn, snapshots=self._snapshots)
+
+    def _order_records(self, level, records):
+        if self.compaction == 'leveled' and level > 0:
+            return sorted(records, key=lambda r: from_json_key(r['min']))
+        return sorted(records, key=lambda r: r['seq'], reverse=True)
+
+    def _load_legacy_levels(self):
+        levels = []
+        add = []
         for level in range(10):
             level_dir = os.path.join(self.directory, f"level{level}")
             comps = []
             if os.path.exists(level_dir):
                 files = sorted([os.path.join(level_dir, f) for f in os.listdir(level_dir) if f.endswith('.dat')])
-                comps = [DiskComponent(f) for f in files]
+                comps = [self._open_component(f) for f in files]
                 comps.sort(key=lambda c: c.extract_num)
                 comps = list(reversed(comps))
+                if self.compaction == 'leveled' and level > 0:
+                    comps.sort(key=lambda c: c.min_key)
+                for c in comps:
+                    self.manifest.next_file = max(self.manifest.next_file, c.extract_num + 1)
+                    add.append((level, self._record(c)))
                 print(f"Loaded level {level} components: {[c.path for c in comps]}")
-            self.levels.append(comps)
-            self.locks.append(asyncio.Lock())
+            levels.append(comps)
+        self.manifest.log(add=add, last_seq=max([c.max_seq for comps in levels for c in comps], default=0))
+        return levels
+
+    def _remove_orphans(self):
+        live = self.manifest.files()
+        for name in os.listdir(self.directory):
+            level_dir = os.path.join(self.directory, name)
+            if not re.fullmatch(r'level\d+', name) or not os.path.isdir(level_dir):
+                continue
+            for f in os.listdir(level_dir):
+                if os.path.join(name, f) not in live:
+                    os.remove(os.path.join(level_dir, f))
+
+    def _relpath(self, comp):
+        return os.path.relpath(comp.path, self.directory)
+
+    def _record(self, comp):
+        return {
+            'file': self._relpath(comp),
+            'min': json_key(comp.min_key),
+            'max': json_key(comp.max_key),
+            'entries': comp.num_keys,
+            'seq': comp.extract_num,
+            'max_seq': comp.max_seq,
+        }
 
         
     async def insert(self, key: str, value: str):
-        flushed = self.memtable.put(key, value)
+        if self.ttl is not None:
+            self._note_time()
+        self.last_seq += 1
+        if self.row_cache is not None:
+            self.row_cache.erase(key)
+        flushed = self.memtable.put(key, value, self.last_seq)
+        commit = self.wal.append([(key, value)], self.last_seq) if self.wal else None
         if flushed:
-            await self._flush_memtable()
+            await self._maybe_flush()
+        if commit is not None:
+            await commit
    
+    async def write(self, batch: WriteBatch):
+        if not batch.ops:
+            return
+        merged = {}
+        for key, value in batch.ops:
+            if self.merge_fn and key in merged:
+                merged[key] = self.merge_fn(merged[key], value)
+            else:
+                merged[key] = value
+        items = list(merged.items())
+        if self.row_cache is not None:
+            for key, _ in items:
+                self.row_cache.erase(key)
+        if self.ttl is not None:
+            self._note_time()
+        seq = self.last_seq + 1
+        self.last_seq += len(items)
+        flushed = self.memtable.put_many(items, seq)
+        commit = self.wal.append(items, seq) if self.wal else None
+        if flushed:
+            await self._maybe_flush()
+        if commit is not None:
+            await commit
+
+    async def insert_many(self, items):
+        batch = WriteBatch()
+        for key, value in items:
+            batch.put(key, value)
+        await self.write(batch)
+
     async def delete(self, key: str):
         await self.insert(key, '<DELETED>')
 
-    async def get(self, key: str):
-        if self.merge_fn:
+    async def delete_range(self, start, end):
+        self.last_seq += 1
+        tombstone = (start, end, self.last_seq)
+        self.manifest.log(range_deletes=[tombstone], last_seq=self.last_seq)
+        self.range_deletes.append(tombstone)
+        self.memtable.delete_range(start, end, self.last_seq)
+        if self.row_cache is not None:
+            self.row_cache.clear()
+
+    def _gc_range_deletes(self):
+        if not self.range_deletes:
+            return
+        oldest_snapshot = self._snapshots.seqs[0] if len(self._snapshots) else None
+        dropped = []
+        with self._acquire() as version:
+            for start, end, t in self.range_deletes:
+                if oldest_snapshot is not None and oldest_snapshot < t:
+                    continue
+                if any(s < t for mem in version.memtables() for _, s, _ in mem.entries(start, end)):
+                    continue
+                if any(c.min_seq < t and c.range_deletes_applied < t for c in version.overlapping(start, end)):
+                    continue
+                dropped.append((start, end, t))
+        if dropped:
+            self.manifest.log(drop_range_deletes=[t for _, _, t in dropped])
+            self.range_deletes = [d for d in self.range_deletes if d not in dropped]
+
+    def snapshot(self):
+        return self._snapshots.acquire(self.last_seq)
+
+    def _combine(self, values):
+        if len(values) == 1:
+            return values[0]
+        if self.value_log is not None:
+            values = [self._resolve(v) for v in values]
+        if self.merge_many is not None:
+            return self.merge_many(values)
+        result = values[0]
+        for v in values[1:]:
+            result = self.merge_fn(result, v) if result else v
+        return result
+
+    def _fold(self, versions, seq, floor=0):
+        values = []
+        now = time.time()
+        for s, v in versions:
+            if seq is not None and s > seq:
+                continue
+            if s < floor or (self.ttl is not None and self._expired(s, now)):
+                break
+            if not self.merge_fn:
+                return self._resolve(v)
+            values.append(v)
+        return self._resolve(self._combine(values)) if values else None
+
+    async def get(self, key: str, snapshot=None):
+        seq = snapshot.seq if snapshot is not None else None
+        if self.row_cache is not None:
+            cached = self.row_cache.get(key)
+            if cached is not None and (seq is None or cached[1] <= seq) and \
+                    (self.ttl is None or not self._expired(cached[1], time.time())):
+                return cached[0]
+        with self._acquire() as version:
+            sources = itertools.chain(version.memtables(), version.overlapping(key, key))
+            versions = itertools.chain.from_iterable(src.versions(key) for src in sources)
+            newest = next(versions, None)
+            if newest is not None:
+                versions = itertools.chain([newest], versions)
+            floor = self._range_floor(key, seq, self.range_deletes)
+            result = self._fold(versions, seq, floor)
+        if not self.merge_fn and result == '<DELETED>':
             result = None
-            val = self.memtable.get(key)
-            if val is not None:
-                result = val
-            for level, comps in enumerate(self.levels):
-                async with self.locks[level]:
-                    for comp in comps:
-                        v = comp.get(key)
-                        if v is not None:
-                            result = self.merge_fn(result, v) if result else v
-            return result
-        val = self.memtable.get(key)
-        if val is not None:
-            if val == '<DELETED>':
-                return None
-            return val
-        for level, comps in enumerate(self.levels):
-            async with self.locks[level]:
-                for comp in comps:
-                    v = comp.get(key)
-                    if v is not None:
-                        if v == '<DELETED>':
-                            return None
-                        return v
-        return None
-
-    async def range(self, start: str, end: str):
-        res = self.memtable.range(start, end)
-        for level, comps in enumerate(self.levels):
-            async with self.locks[level]:
-                for comp in comps:
-                    res.extend(comp.range(start, end))
-        seen = {}
-        for k, v in res:
-            if k not in seen:
-                seen[k] = v
-        return [(k, seen[k]) for k in sorted(seen) if seen[k] != '<DELETED>']
+        newest_seq = max(newest[0] if newest is not None else 0, self._range_floor(key, None, self.range_deletes))
+        if self.row_cache is not None and (seq is None or newest_seq <= seq):
+            self.row_cache.put(key, (result, newest_seq), len(key) + (len(result) if result else 0))
+        return result
 
-    async def _flush_memtable(self):
-        items = self.memtable.flush()
-        if not items:
+    async def multi_get(self, keys, snapshot=None):
+        seq = snapshot.seq if snapshot is not None else None
+        keys = list(keys)
+        pending = sorted(set(keys))
+        found = {k: [] for k in pending}
+        with self._acquire() as version:
+            for src in itertools.chain(version.memtables(), version.components()):
+                if not pending:
+                    break
+                hits = src.multi_versions(pending)
+                for k, versions in hits:
+                    found[k].extend(versions)
+                if not self.merge_fn and hits:
+                    resolved = {k for k, _ in hits if seq is None or any(s <= seq for s, _ in found[k])}
+                    pending = [k for k in pending if k not in resolved]
+        results = {}
+        for k, versions in found.items():
+            floor = self._range_floor(k, seq, self.range_deletes)
+            value = self._fold(versions, seq, floor)
+            if not self.merge_fn and value == '<DELETED>':
+                value = None
+            results[k] = value
+        return [results[k] for k in keys]
+
+    async def scan(self, start: str, end: str, limit=None, reverse=False, snapshot=None):
+        seq = snapshot.seq if snapshot is not None else self.last_seq
+        if limit is not None and limit <= 0:
             return
-        items.sort()
-        num_keys = len(items)
-        bloom_size, num_hashes = BloomFilter.optimal_size(num_keys, 0.01)
-        bloom = BloomFilter(bloom_size, num_hashes)
-        offsets = []
-        data_chunks = []
-        offset = 0
-        for k, v in items:
-            k_bytes = k.encode('utf-8')
-            v_bytes = v.encode('utf-8')
-            bloom.add(k)
-            chunk = (
-                struct.pack('I', len(k_bytes)) + k_bytes +
-                struct.pack('I', len(v_bytes)) + v_bytes
-            )
-            offsets.append(offset)
-            data_chunks.append(chunk)
-            offset += len(chunk)
-        
-        level0_dir = os.path.join(self.directory, "level0")
-        os.makedirs(level0_dir, exist_ok=True)
-        comp_id = len(os.listdir(level0_dir))
-        comp_path = os.path.join(level0_dir, f"comp_{comp_id}.dat")
-        
-        with open(comp_path, 'wb') as f:
-            bloom_bytes = bloom.serialize()
-            f.write(struct.pack('II', num_keys, len(bloom_bytes)))
-            for off in offsets:
-                f.write(struct.pack('Q', off + 8 + num_keys * 8))
-            for chunk in data_chunks:
-                f.write(chunk)
-            f.write(bloom_bytes)
-        
-        async with self.locks[0]:
-            if not self.levels:
-                self.levels.append([])
-                self.locks.append(asyncio.Lock())
-            self.levels[0].insert(0, DiskComponent(comp_path))
-        
-        await self._maybe_merge(0)
+        tombstones = list(self.range_deletes)
+        with self._acquire() as version:
+            cursors = []
+            sources = itertools.chain(version.memtables(), version.overlapping(start, end))
+            for idx, src in enumerate(sources):
+                if isinstance(src, Memtable):
+                    entries = src.entries(start, end)
+                    if reverse:
+                        entries.sort(key=lambda e: (e[0], e[1]), reverse=True)
+                else:
+                    entries = src.cursor(start, end, reverse)
+                if reverse:
+                    cursors.append(((k, s, -idx, v) for k, s, v in entries))
+                else:
+                    cursors.append(((k, -s, idx, v) for k, s, v in entries))
+            merged = heapq.merge(*cursors, reverse=reverse)
+            count = 0
+            for k, group in itertools.groupby(merged, key=lambda e: e[0]):
+                versions = ((s if reverse else -s, v) for _, s, _, v in group)
+                floor = self._range_floor(k, seq, tombstones)
+                value = self._fold(versions, seq, floor)
+                if value is None or value == '<DELETED>':
+                    continue
+                yield k, value
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
+    async def range(self, start: str, end: str, snapshot=None):
+        return [item async for item in self.scan(start, end, snapshot=snapshot)]
+
+    async def _maybe_flush(self):
+        await self._wait_for_flush()
+        if len(self.memtable) >= self.l:
+            task = self._rotate_memtable()
+            if not self.background_flush:
+                await task
+
+    async def _wait_for_flush(self):
+        while self._flush_task is not None:
+            await self._flush_task
+        self._raise_flush_error()
+        if self.immutable is not None:
+            await self._schedule_flush()
+            self._raise_flush_error()
+
+    def _raise_flush_error(self):
+        error, self._flush_error = self._flush_error, None
+        if error is not None:
+            raise error
+
+    def _rotate_memtable(self):
+        self._publish(memtable=self._new_memtable(), immutable=self.memtable)
+        self._flush_segment = self.wal.rotate() if self.wal else None
+        return self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_immutable(self._flush_segment))
+        return self._flush_task
+
+    async def _flush_memtable(self):
+        await self._wait_for_flush()
+        if len(self.memtable):
+            await self._rotate_memtable()
+            self._raise_flush_error()
+
+    async def _flush_immutable(self, segment):
+        try:
+            items = self.immutable.items()
+            flushed_seq = max(seq for _, seq, _ in items)
+            tombstones = list(self.range_deletes)
+            snapshots = self._snapshots.frozen()
+            if tombstones:
+                items = [e for e in items if not self._range_deleted(e[0], e[1], tombstones, snapshots)]
+            applied = self._applied_range_deletes(tombstones, snapshots)
+            comp = await self._run_in_pool(self._write_component, 0, items, applied) if items else None
+            add = [(0, self._record(comp))] if comp is not None else []
+            self.manifest.log(add=add, last_seq=flushed_seq, flushed_seq=flushed_seq)
+            levels = [list(comps) for comps in self.version.levels] or [[]]
+            if comp is not None:
+                levels[0].insert(0, comp)
+            self._publish(levels=levels, immutable=None)
+            self._gc_range_deletes()
+            if segment is not None:
+                await self.wal.release(segment)
+            if self.background_flush:
+                self._schedule_compaction()
+            else:
+                await self._compact_after_flush()
+        except Exception as e:
+            if not self.background_flush:
+                raise
+            self._flush_error = e
+        finally:
+            self._flush_task = None
+
+    def _schedule_compaction(self):
+        self._compaction_task = asyncio.get_running_loop().create_task(
+            self._compact_after_flush(self._compaction_task)
+        )
+
+    async def _compact_after_flush(self, previous=None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self._maybe_merge(0)
+            await self.gc_value_log()
+        except Exception as e:
+            if not self.background_flush:
+                raise
+            self._flush_error = e
+        finally:
+            if self._compaction_task is asyncio.current_task():
+                self._compaction_task = None
+
+    async def _wait_for_tasks(self):
+        while self._flush_task is not None or self._compaction_task is not None:
+            await asyncio.wait([t for t in (self._flush_task, self._compaction_task) if t is not None])
 
     async def flush(self): 
         await self._flush_memtable()
+        await self._wait_for_tasks()
+        self._raise_flush_error()
+
+    async def close(self):
+        await self._wait_for_tasks()
+        self._executor.shutdown()
+        if self._subcompaction_pool is not None:
+            self._subcompaction_pool.shutdown()
+        if self.wal is not None:
+            self.wal.close()
+        for comp in self.version.components():
+            comp.close()
+        if self.value_log is not None:
+            self.value_log.close()
+        self.manifest.close()
+
+
+
+def _run_subcompaction(table, paths, key_range, prefix, level, max_keys, snapshots, tombstones, bottommost,
+                       filter_fpr, applied):
+    components = [DiskComponent(path) for path in paths]
+    written = []
+    try:
+        items = table._merge_iter(components, snapshots, tombstones, bottommost, level, key_range)
+        for i, chunk in enumerate(table._chunks(items, max_keys)):
+            comp = table._write_items(f"{prefix}_{i}.tmp", chunk, filter_fpr, applied)
+            comp.close()
+            if comp.num_keys:
+                written.append(comp.path)
+            else:
+                os.remove(comp.path)
+    finally:
+        for comp in components:
+            comp.close()
+    return written
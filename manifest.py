@@ -0,0 +1,122 @@
+import os
+import json
+import threading
+from encoding import json_key, from_json_key
+
+
+class Manifest:
+    def __init__(self, directory, sync=True, max_edits=1000):
+        self.directory = directory
+        self.path = os.path.join(directory, 'MANIFEST')
+        self.sync = sync
+        self.max_edits = max_edits
+        self.levels = []
+        self.next_file = 0
+        self.last_seq = 0
+        self.flushed_seq = 0
+        self.range_deletes = []
+        self.seq_times = []
+        self.edits = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        torn = False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    edit = json.loads(line)
+                except ValueError:
+                    torn = True
+                    break
+                self._apply(edit)
+                self.edits += 1
+        if torn:
+            self.rewrite()
+        else:
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def new_file_number(self):
+        with self.lock:
+            number = self.next_file
+            self.next_file += 1
+            return number
+
+    def files(self):
+        return {record['file'] for records in self.levels for record in records}
+
+    def _apply(self, edit):
+        for level, name in edit.get('delete', []):
+            self.levels[level] = [r for r in self.levels[level] if r['file'] != name]
+        for level, record in edit.get('add', []):
+            while level >= len(self.levels):
+                self.levels.append([])
+            self.levels[level].append(record)
+        for start, end, seq in edit.get('range_deletes', []):
+            self.range_deletes.append((from_json_key(start), from_json_key(end), seq))
+        self.seq_times = self.seq_times + [tuple(t) for t in edit.get('seq_times', [])]
+        dropped = set(edit.get('drop_range_deletes', []))
+        if dropped:
+            self.range_deletes = [d for d in self.range_deletes if d[2] not in dropped]
+        self.next_file = max(self.next_file, edit.get('next_file', 0))
+        self.last_seq = max(self.last_seq, edit.get('last_seq', 0))
+        self.flushed_seq = max(self.flushed_seq, edit.get('flushed_seq', 0))
+
+    def log(self, add=(), delete=(), last_seq=0, range_deletes=(), drop_range_deletes=(), seq_times=(),
+            flushed_seq=0):
+        edit = {
+            'add': [[level, record] for level, record in add],
+            'delete': [[level, name] for level, name in delete],
+            'next_file': self.next_file,
+            'last_seq': max(self.last_seq, last_seq),
+        }
+        if flushed_seq:
+            edit['flushed_seq'] = flushed_seq
+        if range_deletes:
+            edit['range_deletes'] = self._encode_range_deletes(range_deletes)
+        if drop_range_deletes:
+            edit['drop_range_deletes'] = list(drop_range_deletes)
+        if seq_times:
+            edit['seq_times'] = [list(t) for t in seq_times]
+        self._apply(edit)
+        if self.file is None or self.edits >= self.max_edits:
+            self.rewrite()
+            return
+        self.file.write(json.dumps(edit, separators=(',', ':')) + '\n')
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.edits += 1
+
+    @staticmethod
+    def _encode_range_deletes(range_deletes):
+        return [[json_key(start), json_key(end), seq] for start, end, seq in range_deletes]
+
+    def rewrite(self):
+        snapshot = {
+            'add': [[level, record] for level, records in enumerate(self.levels) for record in records],
+            'range_deletes': self._encode_range_deletes(self.range_deletes),
+            'seq_times': [list(t) for t in self.seq_times],
+            'next_file': self.next_file,
+            'last_seq': self.last_seq,
+            'flushed_seq': self.flushed_seq,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot, separators=(',', ':')) + '\n')
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        if self.file is not None:
+            self.file.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.edits = 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
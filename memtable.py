@@ -2,33 +2,80 @@ from sortedcontainers import SortedDict
 import threading
 
 class Memtable:
-    def __init__(self, max_size, merge_fn=None):
+    def __init__(self, max_size, merge_fn=None, snapshots=None):
         self.data = SortedDict()
         self.max_size = max_size
         self.lock = threading.Lock()
         self.merge_fn = merge_fn
+        self.snapshots = snapshots
+        self.range_deletes = []
 
-    def put(self, key: str, value: str):
+    def _put(self, key, value, seq):
+        versions = self.data.get(key)
+        if versions is None:
+            self.data[key] = [(seq, value)]
+            return
+        top_seq, top_value = versions[0]
+        if (self.snapshots is not None and self.snapshots.has_between(top_seq, seq)) or \
+                any(start <= key <= end and top_seq < t < seq for start, end, t in self.range_deletes):
+            versions.insert(0, (seq, value))
+        elif self.merge_fn:
+            versions[0] = (seq, self.merge_fn(top_value, value))
+        else:
+            versions[0] = (seq, value)
+
+    def put(self, key: str, value: str, seq: int = 0):
+        with self.lock:
+            self._put(key, value, seq)
+            return len(self.data) >= self.max_size
+
+    def put_many(self, items, seq: int = 0):
         with self.lock:
-            if self.merge_fn and key in self.data:
-                self.data[key] = self.merge_fn(self.data[key], value)
-            else:
-                self.data[key] = value
+            for i, (key, value) in enumerate(items):
+                self._put(key, value, seq + i)
             return len(self.data) >= self.max_size
 
+    def delete_range(self, start: str, end: str, seq: int):
+        with self.lock:
+            self.range_deletes.append((start, end, seq))
+
     def get(self, key: str):
         with self.lock:
-            return self.data.get(key)
+            versions = self.data.get(key)
+            return versions[0][1] if versions else None
+
+    def versions(self, key: str):
+        with self.lock:
+            return list(self.data.get(key, ()))
+
+    def multi_versions(self, keys):
+        with self.lock:
+            return [(k, list(self.data[k])) for k in keys if k in self.data]
 
     def range(self, start: str, end: str):
         with self.lock:
             idx1 = self.data.bisect_left(start)
             idx2 = self.data.bisect_right(end)
             keys = self.data.islice(idx1, idx2)
-            return [(k, self.data[k]) for k in keys]
+            return [(k, self.data[k][0][1]) for k in keys]
+
+    def entries(self, start: str, end: str):
+        with self.lock:
+            return [
+                (k, seq, v)
+                for k in self.data.irange(start, end)
+                for seq, v in self.data[k]
+            ]
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        with self.lock:
+            return [(k, seq, v) for k, versions in self.data.items() for seq, v in versions]
 
     def flush(self):
         with self.lock:
-            items = list(self.data.items())
+            items = [(k, seq, v) for k, versions in self.data.items() for seq, v in versions]
             self.data.clear()
             return items
@@ -0,0 +1,38 @@
+from sortedcontainers import SortedList
+
+
+class Snapshot:
+    def __init__(self, snapshots, seq):
+        self.seq = seq
+        self._snapshots = snapshots
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._snapshots.seqs.remove(self.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SnapshotList:
+    def __init__(self, seqs=()):
+        self.seqs = SortedList(seqs)
+
+    def acquire(self, seq):
+        self.seqs.add(seq)
+        return Snapshot(self, seq)
+
+    def has_between(self, lo, hi):
+        idx = self.seqs.bisect_left(lo)
+        return idx < len(self.seqs) and self.seqs[idx] < hi
+
+    def frozen(self):
+        return SnapshotList(self.seqs)
+
+    def __len__(self):
+        return len(self.seqs)
@@ -0,0 +1,179 @@
+import os
+import shutil
+import struct
+import pytest
+from array import array
+from bloom_filter import BloomFilter
+from cache import LruCache
+from component import DiskComponent, MAGIC
+from inverted_index import InvertedIndex
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_block_cache'
+
+
+def _write_flat(path, items):
+    records = [struct.pack('I', len(k)) + k.encode() + struct.pack('QI', seq, len(v)) + v.encode()
+               for k, seq, v in items]
+    bloom = BloomFilter(*BloomFilter.optimal_size(len(items), 0.01))
+    for k, _, _ in items:
+        bloom.add(k)
+    bloom_bytes = bloom.serialize()
+    base = 4 + struct.calcsize('IIQ') + len(items) * 8
+    offsets = array('Q')
+    for rec in records:
+        offsets.append(base)
+        base += len(rec)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('IIQ', len(items), len(bloom_bytes), max(s for _, s, _ in items)))
+        f.write(offsets.tobytes() + b''.join(records) + bloom_bytes)
+
+
+def test_lru_cache_bounded():
+    cache = LruCache(10)
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.usage == 8
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+@pytest.mark.asyncio
+async def test_blocks_across_boundaries():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=200, block_size=64)
+    for i in range(150):
+        await table.insert(f"key{i:03d}", f"val{i}")
+    for i in range(0, 150, 7):
+        await table.insert(f"key{i:03d}", f"new{i}")
+    await table.flush()
+    comp = table.levels[0][0]
+    assert comp.blocked and len(comp.block_keys) > 10
+    assert comp.min_key == 'key000' and comp.max_key == 'key149'
+    assert await table.get('key063') == 'new63'
+    assert await table.get('key064') == 'val64'
+    assert await table.get('key0635') is None
+    expected = [(f"key{i:03d}", f"new{i}" if i % 7 == 0 else f"val{i}") for i in range(40, 81)]
+    assert await table.range('key040', 'key080') == expected
+    assert [kv async for kv in table.scan('key040', 'key080', reverse=True)] == expected[::-1]
+    assert await table.get('key100') == 'val100'
+    misses = table.block_cache.misses
+    for _ in range(5):
+        assert await table.get('key100') == 'val100'
+    assert table.block_cache.misses == misses
+    assert table.block_cache.hits > 0
+    shutil.rmtree(TEST_DIR)
+
+
+def test_flat_format_still_loads():
+    os.makedirs(TEST_DIR, exist_ok=True)
+    path = os.path.join(TEST_DIR, 'flat.dat')
+    _write_flat(path, [('a', 2, 'new'), ('a', 1, 'old'), ('b', 3, 'x')])
+    comp = DiskComponent(path)
+    assert not comp.blocked
+    assert comp.versions('a') == [(2, 'new'), (1, 'old')]
+    assert comp.range('a', 'z') == [('a', 'new'), ('b', 'x')]
+    comp.close()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_inverted_index_shares_cache():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    idx = InvertedIndex(TEST_DIR, r=2, l=4)
+    for i in range(12):
+        await idx.add_document(i, f"cat number {i} sat on mat")
+    await idx.lsm.flush()
+    assert idx.lsm.block_cache is idx.kgram_lsm.block_cache
+    await idx.get_posting('cat')
+    misses = idx.block_cache.misses
+    for _ in range(3):
+        assert len(await idx.get_posting('cat')) == 12
+    assert idx.block_cache.misses == misses
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma', 'bz2'])
+def test_compressed_blocks(compression):
+    os.makedirs(TEST_DIR, exist_ok=True)
+    items = [(f"term{i:04d}", i, 'posting' * 20) for i in range(300)]
+    plain = DiskComponent.write(os.path.join(TEST_DIR, 'plain.dat'), items)
+    packed = DiskComponent.write(os.path.join(TEST_DIR, 'packed.dat'), items, compression=compression,
+                                 cache=LruCache(1 << 20))
+    assert os.path.getsize(packed.path) < os.path.getsize(plain.path) / 4
+    assert packed.versions('term0150') == [(150, 'posting' * 20)]
+    assert packed.range('term0010', 'term0012') == plain.range('term0010', 'term0012')
+    assert list(packed.iter_items()) == items
+    plain.close()
+    packed.close()
+    shutil.rmtree(TEST_DIR)
+
+
+def test_block_checksum_mismatch():
+    os.makedirs(TEST_DIR, exist_ok=True)
+    path = os.path.join(TEST_DIR, 'comp.dat')
+    DiskComponent.write(path, [(f"k{i:03d}", i, 'v') for i in range(200)], block_size=256).close()
+    with open(path, 'r+b') as f:
+        f.seek(300)
+        byte = f.read(1)
+        f.seek(300)
+        f.write(bytes([byte[0] ^ 0xff]))
+    comp = DiskComponent(path)
+    with pytest.raises(IOError):
+        list(comp.iter_items())
+    comp.close()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_unknown_compression():
+    with pytest.raises(ValueError):
+        LsmTable(TEST_DIR, compression='snappy')
+
+
+def test_prefix_encoded_keys():
+    os.makedirs(TEST_DIR, exist_ok=True)
+    items = sorted(((f"start:{i % 32}", 1000 - i, str(i)) for i in range(256)), key=lambda e: (e[0], -e[1]))
+    comp = DiskComponent.write(os.path.join(TEST_DIR, 'bsi.dat'), items, block_size=512, restart_interval=3)
+    assert list(comp.iter_items()) == items
+    for key in ('start:0', 'start:17', 'start:31'):
+        assert comp.versions(key) == [(seq, v) for k, seq, v in items if k == key]
+    assert comp.versions('start:4') == [(seq, v) for k, seq, v in items if k == 'start:4']
+    assert comp.versions('start:') == []
+    assert list(comp.cursor('start:2', 'start:20', reverse=True)) == \
+        sorted((e for e in items if 'start:2' <= e[0] <= 'start:20'), key=lambda e: e[:2], reverse=True)
+    block = comp._block(0)
+    assert len(block.restarts) > 1
+    flat = sum(8 + 4 + len(k) + 12 + len(v) for k, _, v in items)
+    assert os.path.getsize(comp.path) < flat
+    comp.close()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_key_range_pruning():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=10, l=10, block_size=64)
+    for part in 'abc':
+        await table.insert_many((f"{part}{i:02d}", str(i)) for i in range(10))
+    assert len(table.levels[0]) == 3
+    comp = DiskComponent(table.levels[0][0].path, cache=LruCache(1 << 20))
+    assert (comp.min_key, comp.max_key) == ('c00', 'c09')
+    assert comp.cache.misses == 0
+    comp.close()
+    cache = table.block_cache
+    before = cache.hits + cache.misses
+    assert await table.get('b05') == '5'
+    assert cache.hits + cache.misses > before
+    before = cache.hits + cache.misses
+    assert await table.get('d00') is None
+    assert await table.range('0', '9') == []
+    assert cache.hits + cache.misses == before
+    assert [k for k, _ in await table.range('a08', 'b01')] == ['a08', 'a09', 'b00', 'b01']
+    shutil.rmtree(TEST_DIR)
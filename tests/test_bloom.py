@@ -0,0 +1,121 @@
+import os
+import shutil
+import pytest
+from bloom_filter import (
+    BloomFilter, BlockedBloomFilter, DoubleHashBloomFilter, MonkeyFilterPolicy, UniformFilterPolicy, XorFilter,
+    load_filter,
+)
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_bloom'
+
+
+def test_double_hash_bloom():
+    keys = [f"term{i}" for i in range(5000)]
+    bloom = DoubleHashBloomFilter.build(keys, 0.01)
+    assert all(bloom.contains_many(keys))
+    assert all(k in bloom for k in keys[:100])
+    probes = [f"other{i}" for i in range(20000)]
+    hits = bloom.contains_many(probes)
+    assert hits == [k in bloom for k in probes]
+    assert sum(hits) / len(probes) < 0.02
+    bloom.add(b'raw\x00')
+    assert b'raw\x00' in bloom
+
+
+def test_filter_serialization_versions():
+    bloom = DoubleHashBloomFilter.build(['a', 'b'], 0.01)
+    loaded = load_filter(bloom.serialize())
+    assert isinstance(loaded, DoubleHashBloomFilter)
+    assert loaded.contains_many(['a', 'b']) == [True, True]
+    old = BloomFilter(*BloomFilter.optimal_size(2, 0.01))
+    old.add('a')
+    loaded = load_filter(old.serialize())
+    assert isinstance(loaded, BloomFilter) and 'a' in loaded
+
+
+@pytest.mark.parametrize('cls', [BlockedBloomFilter, XorFilter])
+def test_filter_variants(cls):
+    keys = [f"term{i}" for i in range(3000)] + [b'raw\x01']
+    filt = cls.build(keys, 0.01)
+    assert all(filt.contains_many(keys))
+    assert all(k in filt for k in keys)
+    probes = [f"other{i}" for i in range(20000)]
+    hits = filt.contains_many(probes)
+    assert hits[:500] == [k in filt for k in probes[:500]]
+    assert sum(hits) / len(probes) < 0.03
+    loaded = load_filter(filt.serialize())
+    assert type(loaded) is cls
+    assert loaded.contains_many(probes[:500]) == hits[:500]
+
+
+def test_blocked_probes_share_a_cache_line():
+    filt = BlockedBloomFilter.build([f"k{i}" for i in range(1000)], 0.01)
+    for key in ('a', 'b', 'k7'):
+        lines = {pos // 512 for pos in filt._key_positions(key)}
+        assert len(lines) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('filter_type', ['blocked', 'xor'])
+async def test_table_filter_type(filter_type):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=10, filter_type=filter_type)
+    await table.insert_many((f"k{i:03d}", str(i)) for i in range(60))
+    assert await table.multi_get(['k005', 'k059', 'nope']) == ['5', '59', None]
+    del table
+    table = LsmTable(TEST_DIR, r=2, l=10)
+    assert all(isinstance(c.bloom, (BlockedBloomFilter, XorFilter)) for comps in table.levels for c in comps)
+    assert await table.get('k042') == '42'
+    with pytest.raises(ValueError):
+        LsmTable(TEST_DIR, filter_type='cuckoo')
+    shutil.rmtree(TEST_DIR)
+
+
+def test_monkey_policy_budget():
+    import math
+    fprs = MonkeyFilterPolicy(bits_per_key=10).level_fprs(3, 10)
+    assert fprs[0] < fprs[1] < fprs[2] < 1
+    bits = sum(10 ** i * -math.log(p) for i, p in enumerate(fprs)) / 111 / math.log(2) ** 2
+    assert abs(bits - 10) < 1e-6
+    assert sum(fprs) < sum(UniformFilterPolicy(math.exp(-10 * math.log(2) ** 2)).level_fprs(3, 10))
+    assert MonkeyFilterPolicy(bits_per_key=0.2).level_fprs(3, 10)[2] == 1.0
+    assert MonkeyFilterPolicy(skip_last_level=True).level_fprs(3, 10)[2] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_table_filter_policy():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=5, filter_policy=MonkeyFilterPolicy(bits_per_key=8, skip_last_level=True))
+    for i in range(40):
+        await table.insert(f"k{i:03d}", str(i))
+    depth = max(i for i, comps in enumerate(table.levels) if comps)
+    assert all(c.bloom is None for c in table.levels[depth])
+    assert all(c.bloom is not None for comps in table.levels[:depth] for c in comps)
+    io = table.expected_io()
+    assert io['levels'][depth] == len(table.levels[depth])
+    assert io['total'] == pytest.approx(sum(io['levels']))
+    assert [await table.get(f"k{i:03d}") for i in range(40)] == [str(i) for i in range(40)]
+    assert await table.get('k999') is None
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_expected_io_leveled():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=5, compaction='leveled', target_file_size=5,
+                     filter_policy=MonkeyFilterPolicy(bits_per_key=8, skip_last_level=True))
+    for i in range(60):
+        await table.insert(f"k{i:03d}", str(i))
+    await table.flush()
+    depth = max(i for i, comps in enumerate(table.levels) if comps)
+    assert len(table.levels[depth]) > 1
+    io = table.expected_io()
+    assert io['levels'][0] == pytest.approx(sum(c.filter_fpr for c in table.levels[0]))
+    assert io['levels'][depth] == 1.0
+    assert all(io['levels'][i] == max((c.filter_fpr for c in table.levels[i]), default=0)
+               for i in range(1, depth + 1))
+    shutil.rmtree(TEST_DIR)
@@ -0,0 +1,39 @@
+import os
+import shutil
+import pytest
+from pyroaring import BitMap
+from inverted_index import _bitmap_merge, _decode_bitmap, _encode_bitmap
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_bytes'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('options', [{}, {'mmap_reads': True, 'compression': 'zlib'}])
+async def test_bytes_keys_and_values(options):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=8, wal=True, block_size=128, **options)
+    for i in range(50):
+        await table.insert(b'k%03d' % i, bytes([i, 0, 255]) * 3)
+    await table.delete(b'k007')
+    await table.insert(b'k\xff\x00', b'\x00')
+    assert await table.get(b'k010') == bytes([10, 0, 255]) * 3
+    assert await table.get(b'k007') is None
+    assert await table.multi_get([b'k001', b'k\xff\x00', b'zz']) == [bytes([1, 0, 255]) * 3, b'\x00', None]
+    assert [k for k, _ in await table.range(b'k005', b'k009')] == [b'k005', b'k006', b'k008', b'k009']
+    del table
+    table2 = LsmTable(TEST_DIR, r=2, l=8, wal=True, block_size=128, **options)
+    assert await table2.get(b'k\xff\x00') == b'\x00'
+    assert await table2.get(b'k049') == bytes([49, 0, 255]) * 3
+    assert await table2.get(b'k007') is None
+    shutil.rmtree(TEST_DIR)
+
+
+def test_raw_bitmap_postings():
+    a = _encode_bitmap(BitMap([1, 2]))
+    assert isinstance(a, bytes)
+    merged = _bitmap_merge(a, _encode_bitmap(BitMap([3])))
+    assert _decode_bitmap(merged) == BitMap([1, 2, 3])
+    legacy = 'OjAAAAEAAAAAAAAAEAAAAAEA'
+    assert _decode_bitmap(legacy) == BitMap([1])
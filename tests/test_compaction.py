@@ -0,0 +1,187 @@
+import os
+import shutil
+import time
+import random
+import asyncio
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_compaction'
+
+
+def _check_leveled(table):
+    for comps in table.levels[1:]:
+        for comp in comps:
+            assert comp.num_keys <= table.target_file_size
+        for a, b in zip(comps, comps[1:]):
+            assert a.max_key < b.min_key
+
+
+@pytest.mark.asyncio
+async def test_leveled_layout():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    random.seed(7)
+    table = LsmTable(TEST_DIR, r=3, l=10, compaction='leveled', target_file_size=8)
+    expected = {}
+    for i in range(2000):
+        k = f"key{random.randint(0, 400):04d}"
+        expected[k] = str(i)
+        await table.insert(k, str(i))
+    _check_leveled(table)
+    assert len(table.levels[0]) <= 3
+    assert sum(len(c) for c in table.levels[2:]) > 0
+    for k, v in expected.items():
+        assert await table.get(k) == v
+    res = await table.range('key0100', 'key0200')
+    assert res == sorted((k, v) for k, v in expected.items() if 'key0100' <= k <= 'key0200')
+    await table.flush()
+    del table
+    table2 = LsmTable(TEST_DIR, r=3, l=10, compaction='leveled', target_file_size=8)
+    _check_leveled(table2)
+    for k, v in expected.items():
+        assert await table2.get(k) == v
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_leveled_merge_fn():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    merge = lambda a, b: ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+    table = LsmTable(TEST_DIR, r=2, l=5, merge_fn=merge, compaction='leveled')
+    for i in range(300):
+        await table.insert(f"t{i % 20:02d}", str(i))
+    _check_leveled(table)
+    for t in range(20):
+        vals = (await table.get(f"t{t:02d}")).split(',')
+        assert sorted(vals) == sorted(str(i) for i in range(t, 300, 20))
+    shutil.rmtree(TEST_DIR)
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        LsmTable(TEST_DIR, compaction='universal')
+
+
+@pytest.mark.asyncio
+async def test_merge_does_not_block_readers():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+
+    def slow_merge(a, b):
+        time.sleep(0.005)
+        return a
+
+    table = LsmTable(TEST_DIR, r=1, l=20, merge_fn=slow_merge)
+    await table.insert_many((f"k{i:02d}", 'v') for i in range(19))
+    await table.flush()
+    await table.insert_many((f"k{i:02d}", 'v') for i in range(19))
+    merge = asyncio.ensure_future(table.flush())
+    reads = 0
+    while reads < 5:
+        await asyncio.sleep(0.001)
+        assert await table.get('k01') == 'v'
+        reads += 1
+    assert not merge.done()
+    await merge
+    assert len(table.levels[0]) == 0
+    assert await table.get('k05') == 'v'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_version_keeps_files_until_released():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=10)
+    await table.insert_many((f"k{i}", 'old') for i in range(5))
+    await table.flush()
+    version = table._acquire()
+    old = list(version.components())
+    await table.insert_many((f"k{i}", 'new') for i in range(5))
+    await table.flush()
+    assert table.version is not version
+    assert all(os.path.exists(c.path) for c in old)
+    assert [c.get('k1') for c in version.components()] == ['old']
+    version.unref()
+    assert not any(os.path.exists(c.path) for c in old)
+    assert await table.get('k1') == 'new'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_merge_many_operator():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    calls = []
+
+    def merge_many(values):
+        calls.append(len(values))
+        return ','.join(sorted({p for v in values for p in v.split(',')}))
+
+    table = LsmTable(TEST_DIR, r=4, l=2, merge_many=merge_many)
+    for i in range(8):
+        await table.insert('t', str(i))
+        await table.insert(f"pad{i}", 'x')
+    await table.flush()
+    assert 5 in calls
+    holders = sum(1 for comps in table.levels for c in comps if c.versions('t'))
+    calls.clear()
+    assert await table.get('t') == ','.join(str(i) for i in range(8))
+    assert calls == [holders]
+    assert [v for _, v in await table.range('t', 't')] == [','.join(str(i) for i in range(8))]
+    shutil.rmtree(TEST_DIR)
+
+
+def _union(a, b):
+    return ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('merge_fn', [None, _union, lambda a, b: _union(a, b)])
+async def test_subcompactions(merge_fn, monkeypatch):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    splits = []
+    bounds = LsmTable._subcompaction_bounds
+    monkeypatch.setattr(LsmTable, '_subcompaction_bounds',
+                        staticmethod(lambda inputs, n: splits.append(n) or bounds(inputs, n)))
+    random.seed(11)
+    table = LsmTable(TEST_DIR, r=3, l=40, compaction='leveled', merge_fn=merge_fn, subcompactions=4,
+                     block_size=256)
+    pool = 'ThreadPoolExecutor' if merge_fn and merge_fn.__name__ == '<lambda>' else 'ProcessPoolExecutor'
+    assert type(table._subcompaction_pool).__name__ == pool
+    expected = {}
+    for i in range(1500):
+        k = f"key{random.randint(0, 500):04d}"
+        expected[k] = _union(expected[k], str(i)) if merge_fn and k in expected else str(i)
+        await table.insert(k, str(i))
+    await table.flush()
+    assert max(splits) == 4
+    _check_leveled(table)
+    assert await table.range('key0000', 'key9999') == sorted(expected.items())
+    assert not [f for d in os.listdir(TEST_DIR) if d.startswith('level')
+                for f in os.listdir(os.path.join(TEST_DIR, d)) if f.endswith('.tmp')]
+    await table.close()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_leveled_picks_inputs_under_lock():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, compaction='leveled')
+    for n in range(0, 8, 4):
+        await table.insert_many((f"k{i}", str(i)) for i in range(n, n + 4))
+    assert len(table.levels[0]) == 2
+    table.r = 1
+    async with table._compaction_lock:
+        task = asyncio.ensure_future(table._maybe_compact_leveled(0))
+        await asyncio.sleep(0)
+        comp = table.levels[0][0]
+        table._install_rewrite(0, comp, table._write_component(0, comp.iter_items()))
+    await task
+    assert not table.levels[0]
+    assert await table.range('a', 'z') == [(f"k{i}", str(i)) for i in range(8)]
+    shutil.rmtree(TEST_DIR)
@@ -0,0 +1,142 @@
+import os
+import shutil
+import time
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_compaction_filter'
+
+
+def _entries(table):
+    return [e for comps in table.levels for c in comps for e in c.iter_items()]
+
+
+@pytest.mark.asyncio
+async def test_compaction_filter_drops_and_rewrites():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    seen = []
+
+    def keep_live(level, key, value):
+        seen.append(level)
+        if value.startswith('stale'):
+            return None
+        return value.upper() if key.startswith('up:') else value
+
+    table = LsmTable(TEST_DIR, r=2, l=8, compaction_filter=keep_live)
+    for n in range(0, 40, 8):
+        await table.insert_many((f"doc:{i:02d}", 'stale' if i % 4 == 0 else str(i)) for i in range(n, n + 8))
+    await table.insert_many((f"up:{i:02d}", 'v') for i in range(8))
+    await table.flush()
+    assert seen and min(seen) >= 1
+    entries = _entries(table)
+    assert not any(v.startswith('stale') for _, _, v in entries)
+    assert await table.get('doc:04') is None
+    assert await table.get('doc:05') == '5'
+    assert await table.get('up:03') == 'V'
+    assert len(await table.range('doc:', 'doc:~')) == 30
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_compaction_filter_respects_snapshots():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, compaction_filter=lambda level, key, value: None)
+    await table.insert_many((f"k{i}", str(i)) for i in range(4))
+    snap = table.snapshot()
+    for _ in range(3):
+        await table.insert_many((f"j{i}", str(i)) for i in range(4))
+    assert await table.get('k1', snapshot=snap) == '1'
+    assert await table.get('k1') == '1'
+    snap.release()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_ttl_expiry():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, ttl=0.3, row_cache_size=1 << 16)
+    await table.insert_many((f"old{i}", str(i)) for i in range(8))
+    assert await table.get('old3') == '3'
+    time.sleep(0.4)
+    await table.insert_many((f"new{i}", str(i)) for i in range(8))
+    assert await table.get('old3') is None
+    assert await table.get('new3') == '3'
+    assert await table.multi_get(['old1', 'new1']) == [None, '1']
+    assert [k for k, _ in await table.range('a', 'z')] == [f"new{i}" for i in range(8)]
+    for i in range(3):
+        await table.insert_many((f"new{i}", str(i)) for i in range(8))
+    await table.flush()
+    assert not any(k.startswith('old') for k, _, _ in _entries(table))
+
+    table2 = LsmTable(TEST_DIR, r=2, l=4, ttl=0.3)
+    assert await table2.get('new3') == '3'
+    time.sleep(0.4)
+    assert await table2.get('new3') is None
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_filter_dropping_everything():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, compaction_filter=lambda level, key, value: None)
+    for n in range(0, 16, 4):
+        await table.insert_many((f"k{i:02d}", 'v') for i in range(n, n + 4))
+    await table.flush()
+    assert not any(c.num_keys == 0 for comps in table.levels for c in comps)
+    assert sum(len(comps) for comps in table.levels[1:]) == 0
+    live = {k for c in table.levels[0] for k, _, _ in c.iter_items()}
+    assert [k for k, _ in await table.range('a', 'z')] == sorted(live)
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_ttl_expires_whole_merge():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, ttl=0.2)
+    for n in range(0, 8, 4):
+        await table.insert_many((f"k{i:02d}", 'v') for i in range(n, n + 4))
+    time.sleep(0.3)
+    await table.insert_many((f"k{i:02d}", '<DELETED>') for i in range(8, 12))
+    assert sum(len(comps) for comps in table.levels[1:]) == 0
+    assert await table.range('a', 'z') == []
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_filter_invalidates_row_cache():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, row_cache_size=1 << 16,
+                     compaction_filter=lambda level, key, value: None if key == 'k0' else value)
+    await table.insert_many((f"k{i}", 'v') for i in range(4))
+    assert await table.get('k0') == 'v'
+    for n in range(4, 12, 4):
+        await table.insert_many((f"k{i}", 'v') for i in range(n, n + 4))
+    assert table.levels[1]
+    assert await table.get('k0') is None
+    assert await table.multi_get(['k0']) == [None]
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_ttl_merge_operands_expire_individually():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, ttl=0.3, merge_fn=lambda a, b: a + ',' + b)
+    await table.insert('k', 'old')
+    await table.flush()
+    time.sleep(0.4)
+    await table.insert('k', 'new')
+    await table.flush()
+    assert await table.get('k') == 'new'
+    await table.insert('j', 'x')
+    await table.flush()
+    assert len(table.levels[0]) == 0 and table.levels[1]
+    assert await table.get('k') == 'new'
+    assert ('k', 'new') in await table.range('a', 'z')
+    shutil.rmtree(TEST_DIR)
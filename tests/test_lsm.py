@@ -108,3 +108,99 @@ async def test_large():
         assert await table2.get(f"key{i:03d}") == f"val{i:03d}"
     shutil.rmtree(TEST_DIR)
     
+
+@pytest.mark.asyncio
+async def test_background_flush():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=3, background_flush=True)
+    await table.insert('a', '1')
+    await table.insert('b', '2')
+    await table.insert('c', '3')
+    assert table.immutable is not None
+    assert not table._flush_task.done()
+    await table.insert('d', '4')
+    assert await table.get('a') == '1'
+    assert await table.get('d') == '4'
+    assert [k for k, v in await table.range('a', 'z')] == ['a', 'b', 'c', 'd']
+    await table.flush()
+    assert table.immutable is None
+    assert len(table.memtable) == 0
+    del table
+    table2 = LsmTable(TEST_DIR, r=2, l=3)
+    assert [k for k, v in await table2.range('a', 'z')] == ['a', 'b', 'c', 'd']
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_background_flush_not_blocked_by_compaction():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=3, background_flush=True)
+    merge = table._maybe_merge
+    release = asyncio.Event()
+
+    async def slow_merge(level):
+        await release.wait()
+        await merge(level)
+
+    table._maybe_merge = slow_merge
+    for i in range(9):
+        await asyncio.wait_for(table.insert(f"k{i}", str(i)), 1)
+    await asyncio.sleep(0.05)
+    assert table._compaction_task is not None and not table._compaction_task.done()
+    assert len(table.levels[0]) == 3 and table.immutable is None
+    release.set()
+    await table.flush()
+    assert table._compaction_task is None and len(table.levels[0]) <= 1
+    assert [k for k, _ in await table.range('a', 'z')] == [f"k{i}" for i in range(9)]
+    await table.close()
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('background_flush', [False, True])
+async def test_failed_flush_is_retried(background_flush):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=3, background_flush=background_flush)
+    write = table._write_component
+    failures = [OSError(28, 'No space left on device')]
+
+    def flaky_write(*args):
+        if failures:
+            raise failures.pop()
+        return write(*args)
+
+    table._write_component = flaky_write
+    with pytest.raises(OSError):
+        for k in 'abc':
+            await table.insert(k, k.upper())
+        await table.flush()
+    assert table.immutable is not None and table._flush_task is None
+    assert await table.get('b') == 'B'
+    await table.insert('d', 'D')
+    await table.flush()
+    assert table.immutable is None and len(table.memtable) == 0
+    assert [k for k, _ in await table.range('a', 'z')] == ['a', 'b', 'c', 'd']
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_close_releases_resources():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, wal=True, compaction='leveled', subcompactions=2, value_threshold=8)
+    for n in range(0, 24, 4):
+        await table.insert_many((f"k{i:02d}", 'value' * i) for i in range(n, n + 4))
+    await table.insert('tail', 'unflushed')
+    comps = list(table.version.components())
+    await table.close()
+    assert table._executor._shutdown and table._subcompaction_pool._shutdown
+    assert all(c.file.closed for c in comps)
+    assert not table.wal.files and table.value_log.writer is None and table.manifest.file is None
+    table2 = LsmTable(TEST_DIR, r=2, l=4, wal=True, compaction='leveled', value_threshold=8)
+    assert await table2.get('k23') == 'value' * 23
+    assert await table2.get('tail') == 'unflushed'
+    await table2.close()
+    shutil.rmtree(TEST_DIR)
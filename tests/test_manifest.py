@@ -0,0 +1,75 @@
+import os
+import shutil
+import pytest
+from lsm_table import LsmTable
+from manifest import Manifest
+
+TEST_DIR = 'testdata_manifest'
+
+
+async def _fill(table, n):
+    for i in range(n):
+        await table.insert(f"key{i:03d}", f"val{i}")
+    await table.flush()
+
+
+@pytest.mark.asyncio
+async def test_manifest_tracks_components():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=5)
+    await _fill(table, 40)
+    manifest = Manifest(TEST_DIR)
+    manifest.load()
+    for level, comps in enumerate(table.levels):
+        records = manifest.levels[level] if level < len(manifest.levels) else []
+        assert sorted(r['file'] for r in records) == sorted(table._relpath(c) for c in comps)
+        for r in records:
+            comp = next(c for c in comps if table._relpath(c) == r['file'])
+            assert (r['min'], r['max'], r['entries']) == (comp.min_key, comp.max_key, comp.num_keys)
+    numbers = [r['seq'] for records in manifest.levels for r in records]
+    assert len(numbers) == len(set(numbers))
+    assert manifest.next_file > max(numbers)
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_orphans_and_torn_tail():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=5)
+    await _fill(table, 12)
+    del table
+    orphan = os.path.join(TEST_DIR, 'level0', 'comp_999.dat')
+    with open(orphan, 'wb') as f:
+        f.write(b'garbage')
+    with open(os.path.join(TEST_DIR, 'MANIFEST'), 'a') as f:
+        f.write('{"add": [[0, {"fi')
+    table2 = LsmTable(TEST_DIR, r=2, l=5)
+    assert not os.path.exists(orphan)
+    for i in range(12):
+        assert await table2.get(f"key{i:03d}") == f"val{i}"
+    await table2.insert('zzz', '1')
+    await table2.flush()
+    del table2
+    table3 = LsmTable(TEST_DIR, r=2, l=5)
+    assert await table3.get('zzz') == '1'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_legacy_directory_migrated():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=5)
+    await _fill(table, 30)
+    del table
+    os.remove(os.path.join(TEST_DIR, 'MANIFEST'))
+    table2 = LsmTable(TEST_DIR, r=2, l=5)
+    assert os.path.exists(os.path.join(TEST_DIR, 'MANIFEST'))
+    await table2.insert('key100', 'new')
+    await table2.flush()
+    for i in range(30):
+        assert await table2.get(f"key{i:03d}") == f"val{i}"
+    assert await table2.get('key100') == 'new'
+    shutil.rmtree(TEST_DIR)
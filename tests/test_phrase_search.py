@@ -170,3 +170,16 @@ async def test_phrase_persistence():
     assert result2 == [1]
 
     shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_phrase_positions_in_value_log():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    idx = InvertedIndex(TEST_DIR, r=2, l=4, value_threshold=16)
+    for i in range(30):
+        await idx.add_document(i, "the cat sat on the mat" if i % 3 else "the mat sat on the cat")
+    await idx.pos_lsm.flush()
+    assert any(c.blob_refs for comps in idx.pos_lsm.levels for c in comps)
+    assert await idx.phrase_search("cat sat") == [i for i in range(30) if i % 3]
+    shutil.rmtree(TEST_DIR)
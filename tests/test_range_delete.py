@@ -0,0 +1,142 @@
+import os
+import shutil
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_range_delete'
+
+
+def _entries(table):
+    return [e for comps in table.levels for c in comps for e in c.iter_items()]
+
+
+@pytest.mark.asyncio
+async def test_delete_range_reads():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=8)
+    await table.insert_many((f"doc:{i:02d}", str(i)) for i in range(20))
+    await table.insert_many((f"tmp:{i:02d}", str(i)) for i in range(20))
+    snap = table.snapshot()
+    await table.delete_range('tmp:', 'tmp:~')
+    await table.insert('tmp:05', 'again')
+    assert await table.get('tmp:04') is None
+    assert await table.get('tmp:05') == 'again'
+    assert await table.get('doc:04') == '4'
+    assert await table.get('tmp:04', snapshot=snap) == '4'
+    assert await table.range('tmp:', 'tmp:~') == [('tmp:05', 'again')]
+    assert len(await table.range('tmp:', 'tmp:~', snapshot=snap)) == 20
+    assert await table.multi_get(['tmp:01', 'tmp:05', 'doc:01']) == [None, 'again', '1']
+    snap.release()
+    await table.flush()
+    del table
+    table = LsmTable(TEST_DIR, r=4, l=8)
+    assert await table.get('tmp:04') is None
+    assert await table.range('tmp:', 'tmp:~') == [('tmp:05', 'again')]
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_compaction_drops_deleted_data():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=10)
+    await table.insert_many((f"k{i:02d}", str(i)) for i in range(30))
+    await table.delete('k03')
+    await table.delete_range('k10', 'k19')
+    assert table.range_deletes
+    await table.insert_many((f"z{i:02d}", str(i)) for i in range(40))
+    await table.flush()
+    await table.insert_many((f"y{i:02d}", str(i)) for i in range(10))
+    await table.flush()
+    keys = {k for k, _, _ in _entries(table)}
+    assert not any('k10' <= k <= 'k19' for k in keys)
+    assert 'k03' not in keys
+    assert table.range_deletes == []
+    assert await table.get('k20') == '20'
+    del table
+    table = LsmTable(TEST_DIR, r=1, l=10)
+    assert table.range_deletes == []
+    assert [k for k, _ in await table.range('k00', 'k99')] == \
+        [f"k{i:02d}" for i in range(30) if i != 3 and not 10 <= i <= 19]
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_leveled_bottommost_covers_overlapping_files():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=1, compaction='leveled')
+    layout = {
+        3: [('x', 1, 'old')],
+        2: [('a', 2, 'A'), ('x', 3, '<DELETED>')],
+        1: [('b', 4, 'B'), ('c', 5, 'C'), ('d', 6, 'D')],
+    }
+    levels = [[] for _ in range(4)]
+    for level, items in layout.items():
+        comp = table._write_component(level, items)
+        table.manifest.log(add=[(level, table._record(comp))], last_seq=comp.max_seq)
+        levels[level] = [comp]
+    table._publish(levels=levels)
+    table.last_seq = 6
+    assert await table.get('x') is None
+    await table._maybe_compact_leveled(1)
+    assert await table.get('x') is None
+    assert await table.range('a', 'z') == [('a', 'A'), ('b', 'B'), ('c', 'C'), ('d', 'D')]
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_fully_deleted_outputs_are_skipped():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4)
+    for rnd in range(2):
+        await table.insert_many((f"k{i}", str(i)) for i in range(4))
+        await table.insert_many((f"k{i}", '<DELETED>') for i in range(4))
+    await table.insert_many((f"j{i}", str(i)) for i in range(4))
+    assert not any(c.num_keys == 0 for comps in table.levels for c in comps)
+    assert await table.range('a', 'z') == [(f"j{i}", str(i)) for i in range(4)]
+    shutil.rmtree(TEST_DIR)
+
+    table = LsmTable(TEST_DIR, r=2, l=4, compaction='leveled')
+    await table.insert_many((f"k{i}", str(i)) for i in range(3))
+    await table.delete_range('k', 'k~')
+    await table.flush()
+    assert table.immutable is None and not any(table.levels)
+    await table.insert_many((f"k{i}", str(i)) for i in range(4))
+    assert await table.get('k1') == '1'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_delete_range_stops_memtable_merge():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=8, merge_fn=lambda a, b: a + ',' + b)
+    await table.insert('k', 'old')
+    await table.delete_range('a', 'z')
+    await table.insert('k', 'new')
+    await table.insert('k', 'newer')
+    assert await table.get('k') == 'new,newer'
+    assert await table.range('a', 'z') == [('k', 'new,newer')]
+    await table.flush()
+    assert await table.get('k') == 'new,newer'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_scan_keeps_tombstones_while_suspended():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=8)
+    await table.insert_many((f"k{i}", str(i)) for i in range(4))
+    await table.delete_range('k2', 'k3')
+    scan = table.scan('a', 'z')
+    assert await scan.__anext__() == ('k0', '0')
+    await table.flush()
+    await table.insert('x', 'x')
+    await table.flush()
+    assert table.range_deletes == []
+    assert [k async for k, _ in scan] == ['k1']
+    shutil.rmtree(TEST_DIR)
@@ -0,0 +1,67 @@
+import os
+import shutil
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_row_cache'
+
+
+def _union(a, b):
+    return ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+
+
+@pytest.mark.asyncio
+async def test_row_cache_invalidation():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, merge_fn=_union, row_cache_size=1 << 16)
+    for i in range(20):
+        await table.insert('hot', str(i))
+        await table.insert(f"k{i}", 'x')
+    expected = ','.join(sorted(str(i) for i in range(20)))
+    assert await table.get('hot') == expected
+    assert await table.get('hot') == expected
+    assert table.row_cache.hits == 1
+    await table.flush()
+    assert await table.get('hot') == expected
+    assert table.row_cache.hits == 2
+    snap = table.snapshot()
+    await table.insert('hot', 'new')
+    assert await table.get('hot', snapshot=snap) == expected
+    assert await table.get('hot') == expected + ',new'
+    assert await table.get('hot', snapshot=snap) == expected
+    assert await table.get('hot') == expected + ',new'
+    snap.release()
+    assert await table.get('missing') is None
+    assert await table.get('missing') is None
+    await table.insert_many([('missing', 'y')])
+    assert await table.get('missing') == 'y'
+    assert table.row_cache.stats()['hits'] == 5
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_row_cache_delete():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, row_cache_size=1 << 16)
+    await table.insert('a', '1')
+    assert await table.get('a') == '1'
+    await table.delete('a')
+    assert await table.get('a') is None
+    assert await table.get('a') is None
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_read_ignores_newer_tombstone():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=4, row_cache_size=1 << 16)
+    await table.insert('k', 'A')
+    snap = table.snapshot()
+    await table.delete_range('a', 'z')
+    assert await table.get('k', snapshot=snap) == 'A'
+    assert await table.get('k') is None
+    snap.release()
+    shutil.rmtree(TEST_DIR)
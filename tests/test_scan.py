@@ -0,0 +1,104 @@
+import os
+import shutil
+from contextlib import aclosing
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_scan'
+
+
+async def _build(**kwargs):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=7, **kwargs)
+    for i in range(60):
+        await table.insert(f"key{i:02d}", f"old{i}")
+    for i in range(0, 60, 3):
+        await table.insert(f"key{i:02d}", f"new{i}")
+    for i in range(0, 60, 5):
+        await table.delete(f"key{i:02d}")
+    return table
+
+
+def _expected(i):
+    if i % 5 == 0:
+        return None
+    return f"new{i}" if i % 3 == 0 else f"old{i}"
+
+
+@pytest.mark.asyncio
+async def test_scan_forward_and_reverse():
+    table = await _build()
+    expected = [(f"key{i:02d}", _expected(i)) for i in range(10, 41) if _expected(i)]
+    assert [kv async for kv in table.scan('key10', 'key40')] == expected
+    assert [kv async for kv in table.scan('key10', 'key40', reverse=True)] == expected[::-1]
+    assert await table.range('key10', 'key40') == expected
+    assert [kv async for kv in table.scan('key10', 'key40', limit=4)] == expected[:4]
+    assert [kv async for kv in table.scan('key10', 'key40', limit=3, reverse=True)] == expected[::-1][:3]
+    assert [kv async for kv in table.scan('zz', 'zzz')] == []
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_scan_stops_early_and_releases_version():
+    table = await _build()
+    version = table.version
+    refs = version.refs
+    seen = []
+    async with aclosing(table.scan('key00', 'key99')) as it:
+        async for k, v in it:
+            assert version.refs == refs + 1
+            seen.append(k)
+            if len(seen) == 5:
+                break
+    assert version.refs == refs
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_scan_merge_fn():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    merge = lambda a, b: ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+    table = LsmTable(TEST_DIR, r=2, l=4, merge_fn=merge)
+    for i in range(40):
+        await table.insert(f"t{i % 8}", str(i))
+    res = [kv async for kv in table.scan('t0', 't9', reverse=True)]
+    assert [k for k, _ in res] == [f"t{j}" for j in range(7, -1, -1)]
+    for k, v in res:
+        assert sorted(v.split(',')) == sorted(str(i) for i in range(int(k[1:]), 40, 8))
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_multi_get():
+    table = await _build()
+    keys = [f"key{i:02d}" for i in (59, 3, 10, 3, 0, 7)] + ['missing', 'aaa']
+    expected = [await table.get(k) for k in keys]
+    assert await table.multi_get(keys) == expected
+    assert expected[:6] == [_expected(i) for i in (59, 3, 10, 3, 0, 7)]
+    snap = table.snapshot()
+    await table.insert('key07', 'later')
+    await table.delete('key59')
+    assert await table.multi_get(['key07', 'key59'], snapshot=snap) == [_expected(7), _expected(59)]
+    assert await table.multi_get(['key07', 'key59']) == ['later', None]
+    snap.release()
+    assert await table.multi_get([]) == []
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_mmap_reads_match_file_reads():
+    table = await _build()
+    keys = [f"key{i:02d}" for i in range(60)] + ['missing']
+    expected = (await table.multi_get(keys), await table.range('key00', 'key99'),
+                [kv async for kv in table.scan('key05', 'key50', reverse=True)])
+    await table.flush()
+    table2 = LsmTable(TEST_DIR, r=2, l=7, mmap_reads=True)
+    assert all(c.mm is not None for comps in table2.levels for c in comps)
+    assert (await table2.multi_get(keys), await table2.range('key00', 'key99'),
+            [kv async for kv in table2.scan('key05', 'key50', reverse=True)]) == expected
+    await table2.insert_many((f"kéy{i}", str(i)) for i in range(20))
+    assert await table2.get('kéy7') == '7'
+    assert [k for k, _ in await table2.range('kéy0', 'kéy9')][:3] == ['kéy0', 'kéy1', 'kéy10']
+    shutil.rmtree(TEST_DIR)
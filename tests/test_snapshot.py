@@ -0,0 +1,78 @@
+import os
+import shutil
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_snapshot'
+
+
+def _union(a, b):
+    return ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_survives_flush_and_merge():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=4)
+    await table.insert('a', '1')
+    await table.insert('b', '1')
+    snap = table.snapshot()
+    await table.insert('a', '2')
+    await table.delete('b')
+    await table.insert('c', '2')
+    assert await table.get('a') == '2'
+    assert await table.get('a', snapshot=snap) == '1'
+    assert await table.get('c', snapshot=snap) is None
+    for i in range(12):
+        await table.insert(f"k{i:02d}", str(i))
+    await table.flush()
+    assert len(table.levels[0]) == 0
+    assert await table.get('a', snapshot=snap) == '1'
+    assert await table.get('b', snapshot=snap) == '1'
+    assert await table.get('b') is None
+    assert await table.range('a', 'c', snapshot=snap) == [('a', '1'), ('b', '1')]
+    assert await table.range('a', 'c') == [('a', '2'), ('c', '2')]
+    snap.release()
+    for n in range(4):
+        await table.insert_many((f"m{n}{i:02d}", str(i)) for i in range(8))
+        await table.flush()
+    comps = [c for comps in table.levels for c in comps]
+    assert sum(len(c.versions('a')) for c in comps) == 1
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_with_merge_fn():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=1, l=3, merge_fn=_union)
+    await table.insert('t', 'x')
+    with table.snapshot() as snap:
+        await table.insert('t', 'y')
+        await table.insert_many([('u', '1'), ('v', '1'), ('t', 'z')])
+        await table.flush()
+        assert await table.get('t', snapshot=snap) == 'x'
+        assert await table.get('t') == 'x,y,z'
+    await table.insert_many([('w', '1'), ('w2', '1'), ('w3', '1')])
+    await table.flush()
+    assert await table.get('t') == 'x,y,z'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_sequence_numbers_persist():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=4, l=100, wal=True)
+    await table.insert('a', '1')
+    await table.flush()
+    await table.insert('b', '2')
+    last_seq = table.last_seq
+    del table
+    table2 = LsmTable(TEST_DIR, r=4, l=100, wal=True)
+    assert table2.last_seq == last_seq
+    await table2.insert('a', '3')
+    await table2.flush()
+    assert await table2.get('a') == '3'
+    shutil.rmtree(TEST_DIR)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import pytest
+from encoding import ValuePointer
+from lsm_table import LsmTable
+from value_log import ValueLog
+
+TEST_DIR = 'testdata_value_log'
+
+
+def _blob_files():
+    return [f for f in os.listdir(os.path.join(TEST_DIR, 'vlog')) if f.startswith('blob_')]
+
+
+@pytest.mark.asyncio
+async def test_large_values_separated():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=8, value_threshold=100, blob_file_size=4096)
+    for rnd in range(6):
+        await table.insert_many((f"key{i:02d}", f"{rnd}:" + 'x' * (50 + 10 * i)) for i in range(16))
+    await table.flush()
+    entries = [(k, v) for comps in table.levels for c in comps for k, _, v in c.iter_items()]
+    assert any(isinstance(v, ValuePointer) for _, v in entries)
+    assert all(isinstance(v, ValuePointer) == (int(k[3:]) >= 5) for k, v in entries)
+    expected = [(f"key{i:02d}", '5:' + 'x' * (50 + 10 * i)) for i in range(16)]
+    assert await table.range('key00', 'key99') == expected
+    assert await table.multi_get(['key03', 'key12']) == [expected[3][1], expected[12][1]]
+    assert await table.get('key15') == expected[15][1]
+
+    await table.gc_value_log()
+    live = {n for comps in table.levels for c in comps for n in c.blob_refs}
+    assert {int(f[5:-4]) for f in _blob_files()} <= live | {table.value_log.current}
+    assert 0 not in live
+    sizes = table.value_log.sizes
+    assert all(sum(c.blob_refs.get(n, 0) for comps in table.levels for c in comps) > sizes[n] / 2
+               for n in table.value_log.sealed())
+    assert await table.range('key00', 'key99') == expected
+
+    await table.close()
+    table2 = LsmTable(TEST_DIR, r=2, l=8, value_threshold=100, blob_file_size=4096)
+    assert await table2.range('key00', 'key99') == expected
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_value_log_with_merge_fn():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    merge = lambda a, b: a + ',' + b
+    table = LsmTable(TEST_DIR, r=2, l=4, merge_fn=merge, value_threshold=32, blob_file_size=1024)
+    for i in range(60):
+        await table.insert(f"t{i % 4}", f"doc{i:03d}")
+    await table.flush()
+    for j in range(4):
+        assert sorted((await table.get(f"t{j}")).split(',')) == [f"doc{i:03d}" for i in range(j, 60, 4)]
+    assert [k for k, _ in await table.range('t0', 't9')] == ['t0', 't1', 't2', 't3']
+    shutil.rmtree(TEST_DIR)
+
+
+def test_pinned_files_survive_unref():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    vlog = ValueLog(os.path.join(TEST_DIR, 'vlog'), threshold=1, max_file_size=40)
+    old = vlog.put('a', 'x' * 20)
+    vlog.ref({old.file: old.size})
+    with vlog.pinned():
+        pointer = vlog.put('b', 'y' * 20)
+        assert pointer.file == old.file
+        fresh = vlog.put('c', 'z' * 20)
+        assert fresh.file != old.file
+        vlog.unref({old.file: old.size})
+        assert vlog.read(pointer) == 'y' * 20
+    assert old.file not in vlog.sizes
+    assert vlog.read(fresh) == 'z' * 20
+    vlog.close()
+    shutil.rmtree(TEST_DIR)
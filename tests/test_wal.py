@@ -0,0 +1,111 @@
+import os
+import shutil
+import asyncio
+import pytest
+from lsm_table import LsmTable
+
+TEST_DIR = 'testdata_wal'
+
+
+@pytest.mark.asyncio
+async def test_recover_unflushed():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=100, wal=True)
+    await table.insert('a', '1')
+    await table.insert('b', '2')
+    await table.delete('a')
+    del table
+    table2 = LsmTable(TEST_DIR, r=2, l=100, wal=True)
+    assert await table2.get('a') is None
+    assert await table2.get('b') == '2'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_group_commit():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=1000, wal=True)
+    await asyncio.gather(*[table.insert(f"key{i:03d}", f"val{i}") for i in range(500)])
+    assert table.wal.commits < 10
+    del table
+    table2 = LsmTable(TEST_DIR, r=2, l=1000, wal=True)
+    for i in range(500):
+        assert await table2.get(f"key{i:03d}") == f"val{i}"
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_segments_released_after_flush():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=3, wal=True)
+    for i in range(7):
+        await table.insert(f"k{i}", str(i))
+    wal_dir = os.path.join(TEST_DIR, 'wal')
+    assert len(os.listdir(wal_dir)) == 1
+    del table
+    table2 = LsmTable(TEST_DIR, r=2, l=3, wal=True)
+    for i in range(7):
+        assert await table2.get(f"k{i}") == str(i)
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_torn_tail_ignored():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=100, wal=True)
+    await table.insert('a', '1')
+    await table.insert('b', '2')
+    path = table.wal._segment_path(table.wal.current)
+    del table
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    table2 = LsmTable(TEST_DIR, r=2, l=100, wal=True)
+    assert await table2.get('a') == '1'
+    assert await table2.get('b') is None
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_replay_skips_flushed_records():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    add = lambda a, b: str(int(a) + int(b))
+    table = LsmTable(TEST_DIR, r=4, l=100, wal=True, merge_fn=add)
+
+    async def crash_before_release(segment):
+        pass
+
+    table.wal.release = crash_before_release
+    await table.insert('n', '1')
+    await table.insert('n', '1')
+    await table.delete_range('x', 'y')
+    await table.flush()
+    await table.insert('n', '1')
+    assert await table.get('n') == '3'
+    del table
+    table2 = LsmTable(TEST_DIR, r=4, l=100, wal=True, merge_fn=add)
+    assert await table2.get('n') == '3'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_components_synced_before_manifest(monkeypatch):
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=100, wal=True)
+    await table.insert_many((f"k{i}", str(i)) for i in range(10))
+    events = []
+    fsync, log = os.fsync, table.manifest.log
+    monkeypatch.setattr(os, 'fsync', lambda fd: events.append(os.fstat(fd).st_ino) or fsync(fd))
+    monkeypatch.setattr(table.manifest, 'log', lambda **kw: events.append('log') or log(**kw))
+    await table.flush()
+    comp = table.levels[0][0]
+    synced = events[:events.index('log')]
+    assert os.stat(comp.path).st_ino in synced
+    assert os.stat(os.path.dirname(comp.path)).st_ino in synced
+    await table.close()
+    shutil.rmtree(TEST_DIR)
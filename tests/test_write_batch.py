@@ -0,0 +1,65 @@
+import os
+import shutil
+import pytest
+from lsm_table import LsmTable
+from write_batch import WriteBatch
+
+TEST_DIR = 'testdata_write_batch'
+
+
+def _concat(a, b):
+    return ','.join(sorted(set(a.split(',')) | set(b.split(','))))
+
+
+@pytest.mark.asyncio
+async def test_write_batch():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=2, l=100)
+    await table.insert('c', '0')
+    batch = WriteBatch()
+    batch.put('a', '1')
+    batch.put('b', '2')
+    batch.put('a', '3')
+    batch.delete('c')
+    assert len(batch) == 4
+    await table.write(batch)
+    assert await table.get('a') == '3'
+    assert await table.get('b') == '2'
+    assert await table.get('c') is None
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_insert_many_premerges():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    calls = []
+
+    def merge(a, b):
+        calls.append((a, b))
+        return _concat(a, b)
+
+    table = LsmTable(TEST_DIR, r=2, l=100, merge_fn=merge)
+    await table.insert_many([('t', 'x'), ('t', 'y'), ('u', 'z')])
+    assert len(calls) == 1
+    assert table.memtable.get('t') == 'x,y'
+    await table.insert_many([('t', 'w')])
+    assert await table.get('t') == 'w,x,y'
+    shutil.rmtree(TEST_DIR)
+
+
+@pytest.mark.asyncio
+async def test_batch_single_flush():
+    if os.path.exists(TEST_DIR):
+        shutil.rmtree(TEST_DIR)
+    table = LsmTable(TEST_DIR, r=10, l=5, wal=True)
+    await table.insert_many((f"k{i:02d}", str(i)) for i in range(12))
+    assert len(table.levels[0]) == 1
+    assert len(table.memtable) == 0
+    await table.insert_many([('z1', '1'), ('z2', '2')])
+    del table
+    table2 = LsmTable(TEST_DIR, r=10, l=5, wal=True)
+    assert await table2.get('k11') == '11'
+    assert await table2.get('z2') == '2'
+    shutil.rmtree(TEST_DIR)
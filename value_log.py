@@ -0,0 +1,142 @@
+import os
+import re
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from encoding import encode, decode, ValuePointer, LENGTH_MASK
+
+RECORD_HEADER = struct.Struct('III')
+
+
+class ValueLog:
+    def __init__(self, directory, threshold=1024, max_file_size=64 << 20, sync=True):
+        self.directory = directory
+        self.threshold = threshold
+        self.max_file_size = max_file_size
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        files = sorted(
+            int(m.group(1)) for m in map(re.compile(r'blob_(\d+)\.log$').match, os.listdir(directory)) if m
+        )
+        self.sizes = {n: os.path.getsize(self._file_path(n)) for n in files}
+        self.current = files[-1] + 1 if files else 0
+        self.sizes[self.current] = 0
+        self.refs = {}
+        self.pins = []
+        self.writer = None
+        self.readers = {}
+        self.lock = threading.Lock()
+
+    def _file_path(self, number):
+        return os.path.join(self.directory, f"blob_{number}.log")
+
+    def put(self, key, value):
+        v_bytes, v_flag = encode(value)
+        if len(v_bytes) < self.threshold:
+            return value
+        k_bytes, k_flag = encode(key)
+        body = k_bytes + v_bytes
+        record = RECORD_HEADER.pack(len(k_bytes) | k_flag, len(v_bytes) | v_flag, zlib.crc32(body)) + body
+        with self.lock:
+            if self.sizes[self.current] >= self.max_file_size:
+                self._seal()
+            if self.writer is None:
+                self.writer = open(self._file_path(self.current), 'ab')
+            offset = self.sizes[self.current]
+            self.writer.write(record)
+            self.sizes[self.current] += len(record)
+            return ValuePointer(self.current, offset, len(record))
+
+    def _seal(self):
+        if self.writer is not None:
+            self._sync_writer()
+            self.writer.close()
+            self.writer = None
+        self.current += 1
+        self.sizes[self.current] = 0
+
+    def _sync_writer(self):
+        self.writer.flush()
+        if self.sync:
+            os.fsync(self.writer.fileno())
+
+    def flush(self):
+        with self.lock:
+            if self.writer is not None:
+                self._sync_writer()
+
+    def _parse(self, data, pointer):
+        key_len, value_len, crc = RECORD_HEADER.unpack_from(data)
+        body = data[RECORD_HEADER.size:]
+        if len(body) != (key_len & LENGTH_MASK) + (value_len & LENGTH_MASK) or zlib.crc32(body) != crc:
+            raise IOError(f"Corrupt value log record at {pointer}")
+        key = decode(body[:key_len & LENGTH_MASK], key_len)
+        return key, decode(body[key_len & LENGTH_MASK:], value_len)
+
+    def read(self, pointer):
+        with self.lock:
+            if pointer.file == self.current and self.writer is not None:
+                self.writer.flush()
+            fd = self.readers.get(pointer.file)
+            if fd is None:
+                fd = self.readers[pointer.file] = os.open(self._file_path(pointer.file), os.O_RDONLY)
+        return self._parse(os.pread(fd, pointer.size, pointer.offset), pointer)[1]
+
+    def sealed(self):
+        return [n for n in self.sizes if n != self.current]
+
+    def ref(self, blob_refs):
+        with self.lock:
+            for number in blob_refs:
+                self.refs[number] = self.refs.get(number, 0) + 1
+
+    def unref(self, blob_refs):
+        with self.lock:
+            for number in blob_refs:
+                self.refs[number] -= 1
+                if self.refs[number] == 0 and number != self.current and not self._pinned(number):
+                    self._remove(number)
+
+    @contextmanager
+    def pinned(self):
+        with self.lock:
+            start = self.current
+            self.pins.append(start)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.pins.remove(start)
+                self._remove_unreferenced()
+
+    def _pinned(self, number):
+        return any(start <= number for start in self.pins)
+
+    def remove_unreferenced(self):
+        with self.lock:
+            self._remove_unreferenced()
+
+    def _remove_unreferenced(self):
+        for number in [n for n in self.sealed() if not self.refs.get(n) and not self._pinned(n)]:
+            self._remove(number)
+
+    def _remove(self, number):
+        fd = self.readers.pop(number, None)
+        if fd is not None:
+            os.close(fd)
+        self.refs.pop(number, None)
+        self.sizes.pop(number, None)
+        path = self._file_path(number)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self._sync_writer()
+                self.writer.close()
+                self.writer = None
+            for fd in self.readers.values():
+                os.close(fd)
+            self.readers = {}
@@ -0,0 +1,43 @@
+class Version:
+    def __init__(self, memtable, immutable, levels):
+        self.memtable = memtable
+        self.immutable = immutable
+        self.levels = tuple(tuple(comps) for comps in levels)
+        self.refs = 0
+        for comps in self.levels:
+            for comp in comps:
+                comp.ref()
+
+    def memtables(self):
+        if self.immutable is None:
+            return (self.memtable,)
+        return (self.memtable, self.immutable)
+
+    def level(self, level):
+        return self.levels[level] if level < len(self.levels) else ()
+
+    def components(self):
+        for comps in self.levels:
+            yield from comps
+
+    def overlapping(self, start, end):
+        for comps in self.levels:
+            for comp in comps:
+                if comp.overlaps(start, end):
+                    yield comp
+
+    def ref(self):
+        self.refs += 1
+        return self
+
+    def unref(self):
+        self.refs -= 1
+        if self.refs == 0:
+            for comp in self.components():
+                comp.unref()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unref()
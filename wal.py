@@ -0,0 +1,130 @@
+import os
+import re
+import struct
+import zlib
+import asyncio
+from encoding import encode, decode, LENGTH_MASK
+
+
+class WriteAheadLog:
+    def __init__(self, directory, sync=True):
+        self.directory = directory
+        self.sync = sync
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(m.group(1)) for m in map(re.compile(r'wal_(\d+)\.log$').match, os.listdir(directory)) if m
+        )
+        self.current = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(self.current)
+        self.files = {}
+        self.commits = 0
+        self._pending = []
+        self._batch = None
+        self._inflight = None
+        self._writer = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"wal_{segment}.log")
+
+    @staticmethod
+    def _encode(records, seq):
+        parts = [struct.pack('QI', seq, len(records))]
+        for key, value in records:
+            k_bytes, k_flag = encode(key)
+            v_bytes, v_flag = encode(value)
+            parts.append(struct.pack('II', len(k_bytes) | k_flag, len(v_bytes) | v_flag) + k_bytes + v_bytes)
+        body = b''.join(parts)
+        return struct.pack('II', len(body), zlib.crc32(body)) + body
+
+    def replay(self):
+        for segment in self.segments:
+            path = self._segment_path(segment)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            pos = 0
+            while pos + 8 <= len(data):
+                body_len, crc = struct.unpack_from('II', data, pos)
+                body = data[pos + 8:pos + 8 + body_len]
+                if len(body) < body_len or zlib.crc32(body) != crc:
+                    break
+                seq, count = struct.unpack_from('QI', body, 0)
+                p = struct.calcsize('QI')
+                for i in range(count):
+                    key_len, value_len = struct.unpack_from('II', body, p)
+                    p += 8
+                    key = decode(body[p:p + (key_len & LENGTH_MASK)], key_len)
+                    p += key_len & LENGTH_MASK
+                    value = decode(body[p:p + (value_len & LENGTH_MASK)], value_len)
+                    p += value_len & LENGTH_MASK
+                    yield key, value, seq + i
+                pos += 8 + body_len
+
+    def append(self, records, seq):
+        loop = asyncio.get_running_loop()
+        data = self._encode(records, seq)
+        self._pending.append((self.current, data))
+        if self._batch is None:
+            self._batch = loop.create_future()
+        batch = self._batch
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._commit_loop())
+        return batch
+
+    async def _commit_loop(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            pending, batch = self._pending, self._batch
+            self._pending, self._batch = [], None
+            self._inflight = ({seg for seg, _ in pending}, batch)
+            try:
+                await loop.run_in_executor(None, self._write, pending)
+            except Exception as e:
+                batch.set_exception(e)
+            else:
+                batch.set_result(None)
+            finally:
+                self._inflight = None
+
+    def _write(self, pending):
+        touched = {}
+        for segment, data in pending:
+            f = self.files.get(segment)
+            if f is None:
+                f = self.files[segment] = open(self._segment_path(segment), 'ab')
+            f.write(data)
+            touched[segment] = f
+        for f in touched.values():
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        self.commits += 1
+
+    def rotate(self):
+        sealed = self.current
+        self.current += 1
+        self.segments.append(self.current)
+        return sealed
+
+    async def release(self, segment):
+        while True:
+            if self._inflight and any(seg <= segment for seg in self._inflight[0]):
+                await asyncio.wait([self._inflight[1]])
+            elif any(seg <= segment for seg, _ in self._pending):
+                await asyncio.wait([self._batch])
+            else:
+                break
+        for seg in [s for s in self.segments if s <= segment]:
+            f = self.files.pop(seg, None)
+            if f is not None:
+                f.close()
+            path = self._segment_path(seg)
+            if os.path.exists(path):
+                os.remove(path)
+            self.segments.remove(seg)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
@@ -0,0 +1,15 @@
+class WriteBatch:
+    def __init__(self):
+        self.ops = []
+
+    def put(self, key: str, value: str):
+        self.ops.append((key, value))
+
+    def delete(self, key: str):
+        self.ops.append((key, '<DELETED>'))
+
+    def clear(self):
+        self.ops = []
+
+    def __len__(self):
+        return len(self.ops)